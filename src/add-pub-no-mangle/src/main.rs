@@ -0,0 +1,174 @@
+use std::env;
+use std::fs;
+use std::io::{self, Write};
+use std::process;
+
+use proc_macro2::{LineColumn, Span};
+use syn::{Attribute, Item, ItemFn, Meta, Signature, Visibility};
+
+// Makes every top-level function of a Rust file `pub` and `#[no_mangle]`, as
+// the transpiled functions are called through the C ABI. Only the missing
+// keywords and attributes are inserted into the original text, and restricted
+// visibilities such as `pub(crate)` are replaced by `pub`, so comments and
+// formatting are kept. The new attribute is `#[unsafe(no_mangle)]` if the file
+// already uses that form (as required from edition 2024 on) or with --unsafe.
+
+fn main() {
+    let args: Vec<String> = env::args().skip(1).collect();
+    let unsafe_flag = args.iter().any(|arg| arg == "--unsafe");
+    let paths: Vec<&String> = args.iter().filter(|arg| !arg.starts_with("--")).collect();
+
+    if paths.len() != 1 {
+        eprintln!("Usage: add-pub-no-mangle [--unsafe] <path-to-rust-file>");
+        process::exit(1);
+    }
+
+    let code = match fs::read_to_string(paths[0]) {
+        Ok(code) => code,
+        Err(err) => {
+            eprintln!("Unable to read {}: {}", paths[0], err);
+            process::exit(1);
+        }
+    };
+
+    let ast = match syn::parse_file(&code) {
+        Ok(ast) => ast,
+        Err(err) => {
+            let start = err.span().start();
+            eprintln!("Failed to parse {} at {}:{}: {}", paths[0], start.line, start.column, err);
+            process::exit(2);
+        }
+    };
+
+    let functions: Vec<&ItemFn> = ast
+        .items
+        .iter()
+        .filter_map(|item| match item {
+            Item::Fn(item_fn) => Some(item_fn),
+            _ => None,
+        })
+        .collect();
+
+    let unsafe_attr = unsafe_flag
+        || functions
+            .iter()
+            .any(|item_fn| item_fn.attrs.iter().any(|attr| no_mangle_form(attr) == Some(true)));
+    let attr_text = if unsafe_attr { "#[unsafe(no_mangle)]" } else { "#[no_mangle]" };
+
+    let offsets = LineOffsets::new(&code);
+    // (start, end, text) of every replaced byte range, an insertion if empty
+    let mut edits: Vec<(usize, usize, String)> = Vec::new();
+    let mut num_pub = 0;
+    let mut num_no_mangle = 0;
+    for item_fn in functions {
+        let fn_start = signature_span(&item_fn.sig).start();
+        // At the same offset, the edit made last ends up first
+        match &item_fn.vis {
+            Visibility::Inherited => {
+                let offset = offsets.byte_offset(&code, fn_start);
+                edits.push((offset, offset, "pub ".to_string()));
+                num_pub += 1;
+            }
+            Visibility::Restricted(restricted) => {
+                let start = offsets.byte_offset(&code, restricted.pub_token.span.start());
+                let end = offsets.byte_offset(&code, restricted.paren_token.span.close().end());
+                edits.push((start, end, "pub".to_string()));
+                num_pub += 1;
+            }
+            Visibility::Public(_) => {}
+        }
+        // Functions generic over types or consts cannot be unmangled
+        let generic = item_fn.sig.generics.type_params().next().is_some()
+            || item_fn.sig.generics.const_params().next().is_some();
+        if !generic && !item_fn.attrs.iter().any(|attr| no_mangle_form(attr).is_some()) {
+            // Before the other attributes, on its own line with the indentation of the item
+            let item_start = match (item_fn.attrs.first(), &item_fn.vis) {
+                (Some(attr), _) => attr.pound_token.spans[0].start(),
+                (None, Visibility::Public(token)) => token.span.start(),
+                (None, Visibility::Restricted(restricted)) => restricted.pub_token.span.start(),
+                (None, Visibility::Inherited) => fn_start,
+            };
+            let offset = offsets.byte_offset(&code, item_start);
+            let separator = if offsets.starts_line(&code, offset) {
+                "\n".to_string() + &" ".repeat(item_start.column)
+            } else {
+                " ".to_string()
+            };
+            edits.push((offset, offset, attr_text.to_string() + &separator));
+            num_no_mangle += 1;
+        }
+    }
+
+    // Applied from the end, so that the earlier offsets stay valid
+    edits.sort_by(|a, b| b.0.cmp(&a.0));
+    let mut output = code.clone();
+    for (start, end, text) in edits {
+        output.replace_range(start..end, &text);
+    }
+
+    io::stdout().write_all(output.as_bytes()).expect("Unable to write the output");
+    eprintln!("Added pub to {} and {} to {} functions", num_pub, attr_text, num_no_mangle);
+}
+
+// Span of the first token of a signature, i.e. of its qualifiers or `fn`
+fn signature_span(sig: &Signature) -> Span {
+    if let Some(token) = &sig.constness {
+        token.span
+    } else if let Some(token) = &sig.asyncness {
+        token.span
+    } else if let Some(token) = &sig.unsafety {
+        token.span
+    } else if let Some(abi) = &sig.abi {
+        abi.extern_token.span
+    } else {
+        sig.fn_token.span
+    }
+}
+
+// Some(true) for #[unsafe(no_mangle)], Some(false) for #[no_mangle], None for other attributes
+fn no_mangle_form(attr: &Attribute) -> Option<bool> {
+    match &attr.meta {
+        Meta::Path(path) if path.is_ident("no_mangle") => Some(false),
+        Meta::List(list) if list.path.is_ident("unsafe") => {
+            let tokens = list.tokens.to_string();
+            if tokens.trim() == "no_mangle" {
+                Some(true)
+            } else {
+                None
+            }
+        }
+        _ => None,
+    }
+}
+
+// Converts the line (1-based) and column (in chars) of a span into a byte offset
+struct LineOffsets {
+    starts: Vec<usize>,
+}
+
+impl LineOffsets {
+    fn new(code: &str) -> Self {
+        let mut starts = vec![0];
+        for (offset, byte) in code.bytes().enumerate() {
+            if byte == b'\n' {
+                starts.push(offset + 1);
+            }
+        }
+        LineOffsets { starts }
+    }
+
+    fn byte_offset(&self, code: &str, position: LineColumn) -> usize {
+        let line_start = self.starts[position.line - 1];
+        code[line_start..]
+            .char_indices()
+            .nth(position.column)
+            .map(|(offset, _)| line_start + offset)
+            .unwrap_or(code.len())
+    }
+
+    // Whether only whitespace precedes the offset on its line
+    fn starts_line(&self, code: &str, offset: usize) -> bool {
+        let line = self.starts.partition_point(|&start| start <= offset) - 1;
+        code[self.starts[line]..offset].trim().is_empty()
+    }
+}
@@ -0,0 +1,539 @@
+import sys
+import os
+import time
+import atexit
+import resource
+import tempfile
+import csv
+import random
+import datetime
+import subprocess
+import multiprocessing
+from optparse import OptionParser
+import numpy as np
+import pandas
+
+import measure
+import metric_store
+
+import logging
+import log
+logger = logging.getLogger(__name__)
+
+PROGRAM_USAGE = "Usage: \n"\
+                "%prog -m store -f [metricfile] [--scale 10]\n" \
+                "%prog -m select -f [metricfile] [--scale 10]\n" \
+                "%prog -m importtime\n" \
+                "%prog -m typecat [--scale 10]\n" \
+                "%prog -m logging [--scale 10]\n" \
+                "%prog -m pipeline -f [metricfile] [--scales 1,10,100] [--results benchmark_results.csv]\n" \
+                "%prog -m search -f [metricfile] [--seeds 8]\n" \
+                "%prog -m prompt [--functions 200]\n"
+
+chosen_metrics = [
+                'MI_C',
+                'qwen2_5_coder_32b_MI_R',
+                'qwen2_5_coder_32b_avg_unsafe_stmt_R',
+                'qwen2_5_coder_32b_total_uniq_type_R'
+                ]
+
+def parse_args():
+    """Parse and validate command line arguments."""
+    parser = OptionParser(usage=PROGRAM_USAGE)
+
+    parser.add_option('-m', '--mode', action='store', type='str',
+            default=None, help="The benchmark to run. Options: store, select, importtime, typecat, logging, pipeline, search, prompt, progressive")
+    parser.add_option('-f', '--metricfile', action='store', type='str',
+            default="large_set_all_metrics", help="Name of the bundled metric file to benchmark with")
+    parser.add_option('--scale', action='store', type='int',
+            default=10, help="Replication factor of the synthetic metric set")
+    parser.add_option('--repeat', action='store', type='int',
+            default=3, help="Number of repetitions per measurement")
+    parser.add_option('--scales', action='store', type='str',
+            default="1,10", help="Comma separated replication factors of the pipeline benchmark")
+    parser.add_option('--score_sample', action='store', type='int',
+            default=100, help="Number of the tune selections that are scored in the pipeline benchmark")
+    parser.add_option('--results', action='store', type='str',
+            default="benchmark_results.csv", help="File the pipeline benchmark results are appended to")
+
+    parser.add_option('--seeds', action='store', type='int',
+            default=8, help="Number of synthetic transpilation logs the search is compared to the grid on")
+    parser.add_option('--functions', action='store', type='int',
+            default=200, help="Number of synthetic C functions the prompt layouts are compared on")
+    parser.add_option('--selected', action='store', type='int',
+            default=2000, help="Number of selected functions of the progressive evaluation")
+
+    opts, args = parser.parse_args()
+
+    if opts.mode is None:
+        parser.print_help()
+        print("Benchmark mode is not set", file=sys.stderr)
+        sys.exit(1)
+    opts.mode = opts.mode.lower()
+    if opts.mode not in ["store", "select", "importtime", "typecat", "logging", "pipeline", "search", "prompt", "progressive"]:
+        parser.print_help()
+        print("The mode should be set to one of these: store, select, importtime, typecat, logging, pipeline, search, prompt, progressive", file=sys.stderr)
+        sys.exit(1)
+
+    return (opts, args)
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _isolated_worker(queue, func, args):
+    rss_before = peak_rss_mb()
+    start_time = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start_time
+    queue.put((elapsed, peak_rss_mb() - rss_before))
+
+def run_isolated_worker(worker, *args):
+    # Run worker(queue, *args) in a fresh interpreter and return what it puts on the queue
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=worker, args=(queue,) + args)
+    p.start()
+    res = queue.get()
+    p.join()
+    return res
+
+def run_isolated(func, *args):
+    # Run func in a fresh interpreter so that the peak RSS is not shared
+    # between the measured loaders
+    return run_isolated_worker(_isolated_worker, func, args)
+
+def replicate_metrics(df, scale):
+    # Synthetic metric set: the bundled rows repeated scale times with unique ids
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        copy["id"] = copy["id"] + "#" + str(i)
+        copies.append(copy)
+    return pandas.concat(copies, ignore_index=True)
+
+def load_pickle_projected(metricfile):
+    df = pandas.read_pickle(metricfile + ".pkl")
+    return df[["id"] + chosen_metrics].to_numpy()
+
+def load_store_projected(metricfile):
+    df = metric_store.load_metrics(metricfile, chosen_metrics)
+    return df[chosen_metrics].to_numpy()
+
+def bench_store(metricfile, scale, repeat):
+    df = pandas.read_pickle(metricfile + ".pkl")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sets = [("x1", df), ("x" + str(scale), replicate_metrics(df, scale))]
+        for set_name, set_df in sets:
+            set_file = os.path.join(tmp_dir, set_name)
+            set_df.to_pickle(set_file + ".pkl")
+            metric_store.save_metrics(set_df, set_file)
+
+            for loader_name, loader in [("pickle", load_pickle_projected), ("store", load_store_projected)]:
+                results = [run_isolated(loader, set_file) for _ in range(repeat)]
+                load_time = min(r[0] for r in results)
+                best_rss = min(r[1] for r in results)
+                logger.info(set_name + " (" + str(len(set_df)) + " rows) " + loader_name +
+                            ": load " + str(round(load_time * 1000, 2)) + " ms, RSS +" +
+                            str(round(best_rss, 2)) + " MB")
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        res = func()
+        times.append(time.perf_counter() - start_time)
+    return min(times), res
+
+def bench_select(metricfile, scale, repeat):
+    # Per-selection cost of the per-bin loop and of the vectorized stride sampling
+    df = metric_store.load_metrics(metricfile, chosen_metrics)
+    df = replicate_metrics(df, scale) if scale > 1 else df
+    scores = measure.get_summary_complexity(df, chosen_metrics)
+    ratios = [round(x * 0.002, 3) for x in range(1, 101)]
+
+    for num_of_partition in [1, 5, 10, 20]:
+        df_cells, starts = measure.partition_cells(df, chosen_metrics, num_of_partition, scores)
+        bins = measure.partition(df, chosen_metrics, num_of_partition, scores)
+        loop_time, loop_res = best_time(lambda: measure.select_from_bins(bins, ratios[-1]), repeat)
+        cells_time, cells_res = best_time(lambda: measure.select_from_cells(starts, len(df_cells), ratios), repeat)
+
+        if list(loop_res["id"]) != list(df_cells["id"].to_numpy()[cells_res[-1]]):
+            logger.error("Vectorized selection differs for " + str(num_of_partition) + " partitions")
+        logger.info(str(len(df)) + " rows, " + str(len(starts)) + " bins: per-bin loop " +
+                    str(round(loop_time * 1000, 3)) + " ms, vectorized " +
+                    str(round(cells_time * 1000 / len(ratios), 3)) + " ms per selection")
+
+# Modules imported by each mode of the pipeline before it starts working
+startup_modules = {
+    "main (get/select/tune)": "main",
+    "evaluate_selections": "evaluate_selections",
+    "evaluate_selections_cross_llm": "evaluate_selections_cross_llm",
+    "llm_transpile": "llm_transpile_with_compilation_fixing",
+}
+
+def parse_importtime(stderr):
+    # Returns (cumulative us, depth, module) for every import of a -X importtime run
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two more spaces per level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        imports.append((int(cumulative_us), depth, name.strip()))
+    return imports
+
+def bench_importtime(repeat):
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for mode, module in startup_modules.items():
+        results = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                               cwd=src_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            elapsed = time.perf_counter() - start_time
+            results.append((elapsed, parse_importtime(p.stderr)))
+            if p.returncode != 0:
+                logger.warning("Importing " + module + " failed: " + p.stderr.strip().splitlines()[-1])
+        elapsed, imports = min(results, key=lambda x: x[0])
+        total_us = sum(x[0] for x in imports if x[1] == 0)
+        heaviest = sorted([x for x in imports if x[1] == 1], reverse=True)[:5]
+        logger.info(mode + ": startup " + str(round(elapsed * 1000, 1)) + " ms, imports " +
+                    str(round(total_us / 1000, 1)) + " ms, heaviest: " +
+                    ", ".join(name + " " + str(round(us / 1000, 1)) + " ms" for us, depth, name in heaviest))
+
+# Reference implementation of measure.get_type_cat before it became table-driven
+def legacy_type_cat(line):
+    cat = ""
+    if "NotIdentified#" in line[2]:
+        return None
+    
+    if "*" == line[2][:1] or "&" == line[2][:1] \
+        or line[2] == "libc::c_void" or line[2] == "libc :: c_void":
+        cat = "pointer"
+    elif line[2] == "i64" or line[2] == "i32" \
+            or line[2] == "u64" or line[2] == "u32" \
+            or line[2] == "c_uint" or line[2] == "c_int" or line[2] == "libc :: c_int" \
+            or line[2][-7:] == "c_ulong" or line[2][-6:] == "c_long" \
+            or line[2] == "libc :: size_t" or line[2] == "size_t" or line[2] == "c_size_t"\
+            or line[2] == "usize" or line[2] == "isize" \
+            or line[2] == "u8" or line[2] == "i8" \
+            or line[2] == "i128" or line[2] == "u_int" or line[2] == "int":
+        cat = "integer"
+    elif line[2] == "f64" or line[2] == "f32" or line[2] == "float" \
+            or line[2] == "c_double":
+        cat = "float"
+    elif line[2] == "string":
+        cat = "string"
+    elif line[2] == "char" or line[2] == "c_char" or line[2] == "libc :: c_char":
+        cat = "char"
+    elif line[2] == "bool":
+        cat = "bool"
+    elif line[2][:4] == "enum":
+        cat = "enum"
+    elif line[2][:5] == "array":
+        cat = "array"
+    elif line[2][:5] == "tuple":
+        cat = "tuple"
+    elif line[2][:6] == "struct" \
+        or line[2] == "libc::timespec" or line[2] == "libc::timespec":
+        cat = "struct"
+    elif line[2] == "Vec<u8>" or line[2] == "Vec < u8 >":
+        cat = "vector"
+    elif line[2][:7] == "HashMap":
+        cat = "hashmap"
+    elif line[2][:6] == "Option":
+        cat = "option"
+    else:
+        cat = None
+
+    return cat
+
+def type_names_corpus(scale):
+    # Type names as printed by dump-var-types: every known name, the prefixed
+    # and suffixed families, pointers, unidentified and unknown types
+    names = list(measure.type_cat_exact) + ["*mut " + x for x in measure.type_cat_exact] + \
+            ["&" + x for x in measure.type_cat_exact] + ["libc :: c_ulong", "c_long", "std::os::raw::c_long", "struct c_long", "enum c_ulong"]
+    for prefixes in measure.type_cat_prefixes.values():
+        names += [x + suffix for x in prefixes for suffix in ["", " Foo", "<i32>", "(u8, u8)"]]
+    names += ["NotIdentified#" + x for x in ["a", "b", "i32"]]
+    names += ["Box<T" + str(i) + ">" for i in range(200)] + ["Vec<i" + str(i) + ">" for i in range(200)] + ["", "*"]
+    rnd = random.Random(0)
+    return [rnd.choice(names) for _ in range(10000 * scale)]
+
+def bench_typecat(scale, repeat):
+    type_names = type_names_corpus(scale)
+    lines = [["Local", "x", x] for x in type_names]
+
+    legacy_time, legacy_res = best_time(lambda: [legacy_type_cat(x) for x in lines], repeat)
+    def table_cold():
+        measure.type_category.cache_clear()
+        return measure.get_type_cats(type_names)
+    cold_time, table_res = best_time(table_cold, repeat)
+    line_time, line_res = best_time(lambda: [measure.get_type_cat(x) for x in lines], repeat)
+
+    mismatches = sorted(set((x, a, b) for x, a, b in zip(type_names, legacy_res, table_res) if a != b))
+    if mismatches or line_res != legacy_res:
+        logger.error("Type categories differ for " + str(len(mismatches)) + " names: " + str(mismatches[:5]))
+    else:
+        logger.info("Type categories identical for " + str(len(set(type_names))) + " distinct names")
+    for name, elapsed in [("if/elif chain", legacy_time), ("table, whole column", cold_time), ("table, per line", line_time)]:
+        logger.info(name + ": " + str(round(len(lines) / elapsed / 1e6, 2)) + " M types/s")
+
+def bench_logging(scale, repeat):
+    # Logging cost of the four metric passes over 1500 * scale files: a colored
+    # DEBUG line per file vs the bulk configuration with progress lines
+    num_files = 4 * 1500 * scale
+    bench_logger = logging.getLogger("bench_logging")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.DEBUG)
+
+    with open(os.devnull, "w") as devnull:
+        def per_file():
+            handler = log.colored_handler(devnull)
+            bench_logger.addHandler(handler)
+            for i in range(num_files):
+                bench_logger.debug("Processing: " + os.path.join("Benchmark", "proj", "file" + str(i) + ".rs"))
+            bench_logger.removeHandler(handler)
+
+        bulk = log.bulk_handler(devnull)
+        def progress_only():
+            bench_logger.addHandler(bulk)
+            progress = log.ProgressLogger(bench_logger, "bench", num_files, interval=1.0)
+            for i in range(num_files):
+                progress.update()
+            progress.done()
+            bench_logger.removeHandler(bulk)
+
+        per_file_time, res = best_time(per_file, repeat)
+        bulk_time, res = best_time(progress_only, repeat)
+        atexit.unregister(bulk.listener.stop)
+        bulk.listener.stop()
+
+    for name, elapsed in [("colored line per file", per_file_time), ("bulk with progress lines", bulk_time)]:
+        logger.info(name + ": " + str(round(elapsed * 1000, 1)) + " ms for " + str(num_files) + " files (" +
+                    str(round(elapsed * 1e6 / num_files, 2)) + " us per file)")
+
+def synthetic_transpilation_log(ids, scores, seed=0):
+    # Transpilation log entries keyed like the real log, with compilation fixing
+    # attempts (0-20) and times (s) that tend to grow with the summary complexity
+    rng = np.random.default_rng(seed)
+    ranks = np.argsort(np.argsort(scores)) / max(1, len(scores) - 1)
+    attempts = np.minimum(20, rng.geometric(1 / (1 + 3 * ranks)) - 1)
+    transpilation_times = np.round(rng.gamma(2, 5 + 20 * ranks))
+    fix_times = np.round(rng.gamma(2, 10, size=len(attempts)) * attempts)
+    post_iters = rng.poisson(ranks)
+    post_times = np.round(rng.gamma(2, 4, size=len(attempts)) * post_iters)
+    transpilation_log_dict = {}
+    for id, fields in zip(ids, zip(transpilation_times, attempts, fix_times, post_iters, post_times)):
+        key = id.replace(":", "#") + ".c"
+        transpilation_log_dict[key] = [key, "True", "True"] + [str(int(x)) for x in fields]
+    return transpilation_log_dict
+
+def _pipeline_worker(queue, metricfile, scale, score_sample):
+    import main as pipeline
+    import evaluate_selections
+    import scoring
+
+    results = []
+    def stage(name, func):
+        start_time = time.perf_counter()
+        res = func()
+        results.append((name, time.perf_counter() - start_time, peak_rss_mb()))
+        return res
+
+    df = stage("load", lambda: metric_store.load_metrics(metricfile, chosen_metrics))
+    if scale > 1:
+        df = stage("replicate", lambda: replicate_metrics(df, scale))
+    df_sorted = stage("PCA_analysis", lambda: measure.PCA_analysis(df.copy(), chosen_metrics))
+    scores = df_sorted["summary_complexity_pca"].sort_index().to_numpy()
+    bins = stage("partition", lambda: measure.partition(df, chosen_metrics, 9, scores))
+    stage("select_from_bins", lambda: measure.select_from_bins(bins, 0.166))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        set_file = os.path.join(tmp_dir, "metrics")
+        stage("store write", lambda: metric_store.save_metrics(df, set_file))
+        out_dir = os.path.join(tmp_dir, "selections")
+        os.mkdir(out_dir)
+        stage("tune", lambda: [pipeline.select_funcs(out_dir, num_of_partition, pipeline.tune_ratios, set_file)
+                               for num_of_partition in pipeline.tune_partitions])
+
+        transpilation_log_dict = synthetic_transpilation_log(df["id"], scores)
+        log_file = os.path.join(tmp_dir, "transpilation.log")
+        with open(log_file, "w") as f:
+            for elems in transpilation_log_dict.values():
+                f.write(";".join(elems) + "\n")
+        files = sorted(os.listdir(out_dir))
+        files = files[::max(1, len(files) // score_sample)][:score_sample]
+        stage("score " + str(len(files)) + " of " + str(len(os.listdir(out_dir))),
+              lambda: [scoring.score_selection(transpilation_log_dict,
+                            evaluate_selections.read_selection(os.path.join(out_dir, x))[0]) for x in files])
+
+        sweep_dir = os.path.join(tmp_dir, "sweep")
+        os.mkdir(sweep_dir)
+        stage("sweep", lambda: pipeline.sweep_funcs(sweep_dir, log_file, set_file, pipeline.tune_partitions, pipeline.tune_ratios))
+
+    queue.put((len(df), results))
+
+def bench_pipeline(metricfile, scales, score_sample, results_file):
+    # Every scale runs in a fresh interpreter, the peak RSS is the one reached
+    # by the end of each stage
+    write_header = not os.path.exists(results_file)
+    with open(results_file, "a", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        if write_header:
+            writer.writerow(["date", "metricfile", "scale", "rows", "stage", "wall_time_s", "peak_rss_mb"])
+        date = datetime.datetime.now().isoformat(timespec="seconds")
+        for scale in scales:
+            num_rows, results = run_isolated_worker(_pipeline_worker, metricfile, scale, score_sample)
+            for name, elapsed, rss in results:
+                logger.info("x" + str(scale) + " (" + str(num_rows) + " rows) " + name + ": " +
+                            str(round(elapsed, 3)) + " s, peak RSS " + str(round(rss, 1)) + " MB")
+                writer.writerow([date, metricfile, scale, num_rows, name, round(elapsed, 6), round(rss, 1)])
+            f.flush()
+    logger.info("Results appended to " + results_file)
+
+def bench_search(metricfile, num_seeds):
+    # Compares the adaptive search to the full grid for synthetic transpilation
+    # logs and several limits on the selection size: how often it finds the grid
+    # optimum and how many selections it scores
+    import main as pipeline
+    import search
+
+    df = metric_store.load_metrics(metricfile, chosen_metrics)
+    scores = measure.get_summary_complexity(df, chosen_metrics, metricfile)
+    max_selected_ls = [None, 500, 1000, 2000, 4000]
+    num_grid = len(pipeline.tune_partitions) * len(pipeline.tune_ratios)
+
+    found, evaluations, grid_time, search_time = 0, [], 0.0, 0.0
+    for seed in range(num_seeds):
+        transpilation_log_dict = synthetic_transpilation_log(df["id"], scores, seed)
+        start_time = time.perf_counter()
+        grid = search.SweepEvaluator(df, chosen_metrics, scores, transpilation_log_dict, pipeline.tune_ratios)
+        for num_of_partition in pipeline.tune_partitions:
+            for index in range(len(pipeline.tune_ratios)):
+                grid.evaluate(num_of_partition, index)
+        grid_time += time.perf_counter() - start_time
+
+        for max_selected in max_selected_ls:
+            grid_best = min((diff, num_of_partition, index) for (num_of_partition, index), diff in grid.results.items()
+                            if max_selected is None or grid.partitioning(num_of_partition)[2][index] <= max_selected)
+            start_time = time.perf_counter()
+            evaluator = search.SweepEvaluator(df, chosen_metrics, scores, transpilation_log_dict, pipeline.tune_ratios)
+            best = search.successive_halving(evaluator, pipeline.tune_partitions, max_selected)
+            search_time += time.perf_counter() - start_time
+            evaluations.append(evaluator.num_evaluations)
+            if best == grid_best:
+                found += 1
+            else:
+                logger.info("Seed " + str(seed) + ", max_selected " + str(max_selected) + ": grid optimum " +
+                            str(round(grid_best[0], 2)) + "% at " + str(grid_best[1:]) + ", search " +
+                            str(round(best[0], 2)) + "% at " + str(best[1:]))
+
+    num_runs = num_seeds * len(max_selected_ls)
+    logger.info("Search found the grid optimum in " + str(found) + " of " + str(num_runs) + " runs, scoring " +
+                str(round(np.mean(evaluations), 1)) + " selections on average instead of " + str(num_grid) +
+                " (" + str(round(100 * (1 - np.mean(evaluations) / num_grid), 1)) + "% saved)")
+    logger.info("Grid: " + str(round(grid_time / num_seeds, 3)) + " s per log, search: " +
+                str(round(search_time / num_runs, 3)) + " s per run")
+
+def bench_prompt(num_functions, prompt_eval_per_token=0.0005, seed=0):
+    # Prompt evaluation time of the transpilation requests of synthetic C functions
+    # in both prompt layouts, against the fake Ollama server, whose prompt cache
+    # keeps the longest common prefix with the previous conversation
+    os.environ.setdefault("FAKE_PROMPT_EVAL_PER_TOKEN", str(prompt_eval_per_token))
+    import contextlib
+    import ollama
+    import fake_ollama
+    import synthetic_benchmark
+    import tool_runner
+    import llm_transpile_with_compilation_fixing as transpiler
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server = fake_ollama.start_ollama()
+    transpiler.client = ollama.Client(host="127.0.0.1:" + str(server.server_address[1]))
+    rnd = random.Random(seed)
+    c_functions = [synthetic_benchmark.generate_function(rnd, "func" + str(i))[0] for i in range(num_functions)]
+
+    results = {}
+    for name, layout, keep_alive in [("suffix", "suffix", None), ("prefix", "prefix", None), ("prefix, keep_alive 0", "prefix", 0)]:
+        transpiler.PROMPT_LAYOUT = layout
+        transpiler.KEEP_ALIVE = keep_alive
+        del transpiler.prompt_evals[:]
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for input_C in c_functions:
+                transpiler.transpile_with_chatgpt_web(input_C)
+        durations = sorted(x[1] for x in transpiler.prompt_evals)
+        results[name] = sum(durations)
+        logger.info(name + ": " + str(round(np.mean([x[0] for x in transpiler.prompt_evals]), 1)) + " tokens evaluated per request, prompt eval p50 " +
+                    str(round(tool_runner.percentile(durations, 50) * 1000, 1)) + " ms, p95 " +
+                    str(round(tool_runner.percentile(durations, 95) * 1000, 1)) + " ms, total " + str(round(results[name], 2)) + "s")
+    server.shutdown()
+    logger.info("The prefix layout saves " + str(round(100 * (1 - results["prefix"] / results["suffix"]), 1)) +
+                "% of the prompt eval time of " + str(num_functions) + " functions")
+
+def bench_progressive(num_selected, num_seeds, tolerance=2.0, min_functions=10, num_strata=10):
+    # Simulates the progressive evaluation of a selection with synthetic attempt
+    # counts: where it stops and whether the upper bound of the histogram error
+    # covers the actual error there. A homogeneous early sample, e.g. of a strong
+    # model that rarely needs fixing, must not give a zero-width bound.
+    import scoring
+    import llm_transpile_with_compilation_fixing as transpiler
+
+    shares = {
+        "long-tailed": np.append(0.6 * 0.55 ** np.arange(scoring.NUM_OF_ATTEMPT_KEYS), 0.02),
+        "strong model": np.append([0.97, 0.02, 0.01], np.zeros(scoring.NUM_OF_ATTEMPT_KEYS - 2)),
+    }
+    failures = 0
+    for name, pvals in shares.items():
+        pvals = pvals / pvals.sum()
+        for seed in range(num_seeds):
+            rng = np.random.default_rng(seed)
+            codes = rng.choice(len(pvals), size=num_selected, p=pvals)
+            ids = [str(i) for i in range(num_selected)]
+            ids, strata = transpiler.stratified_order(ids, {x: float(x) for x in ids}, seed, num_strata)
+            codes = codes[[int(x) for x in ids]]
+            actual = np.bincount(codes, minlength=scoring.NUM_OF_ATTEMPT_KEYS + 1) / num_selected
+
+            estimate = scoring.ProgressiveEstimate(strata, seed=seed)
+            for index, code in enumerate(codes):
+                estimate.add(index, code)
+                median, lower, upper = estimate.intervals()["histogram"]
+                if index + 1 < num_selected and upper <= 0:
+                    failures += 1
+                    logger.error(name + ", seed " + str(seed) + ": zero-width bound after " + str(index + 1) + " functions")
+                if index + 1 >= min_functions and upper <= tolerance:
+                    break
+            error = np.abs(estimate.histogram() - actual).max() * 100
+            logger.info(name + ", seed " + str(seed) + ": stopped after " + str(index + 1) + " of " + str(num_selected) +
+                        " functions, bound " + str(round(upper, 2)) + "%, actual error " + str(round(error, 2)) + "%")
+    if failures:
+        sys.exit(1)
+
+def main():
+
+    opts, args = parse_args()
+    log.init_log(logging.INFO)
+
+    if opts.mode == "store":
+        bench_store(opts.metricfile, opts.scale, opts.repeat)
+    elif opts.mode == "select":
+        bench_select(opts.metricfile, opts.scale, opts.repeat)
+    elif opts.mode == "importtime":
+        bench_importtime(opts.repeat)
+    elif opts.mode == "typecat":
+        bench_typecat(opts.scale, opts.repeat)
+    elif opts.mode == "logging":
+        bench_logging(opts.scale, opts.repeat)
+    elif opts.mode == "pipeline":
+        bench_pipeline(opts.metricfile, [int(x) for x in opts.scales.split(",")], opts.score_sample, opts.results)
+    elif opts.mode == "search":
+        bench_search(opts.metricfile, opts.seeds)
+    elif opts.mode == "prompt":
+        bench_prompt(opts.functions)
+    elif opts.mode == "progressive":
+        bench_progressive(opts.selected, opts.seeds)
+
+if __name__ == "__main__":
+    main()
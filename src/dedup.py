@@ -0,0 +1,58 @@
+import hashlib
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+def normalize_source(source):
+    # Indentation and trailing whitespace do not change the metrics or the
+    # transpilation, so they are stripped from every line before hashing. The line
+    # breaks are kept, as the line counts depend on them, and so is the indentation
+    # of a line continued by a backslash, which may be inside a string literal
+    lines = []
+    continued = False
+    for line in source.splitlines():
+        lines.append(line.rstrip() if continued else line.strip())
+        continued = line.rstrip().endswith("\\")
+    return "\n".join(lines)
+
+def text_digest(source):
+    return hashlib.sha1(normalize_source(source).encode()).hexdigest()
+
+def source_digest(path):
+    with open(path, "r", errors="replace") as fp:
+        return text_digest(fp.read())
+
+class DedupCache:
+    # Keeps the result of each unique source, so that duplicates are analyzed
+    # (or transpiled) once and the result is fanned back out to every id
+    def __init__(self, name):
+        self.name = name
+        self.results = {}
+        self.elapsed = {}
+        self.seen = set()
+        self.total = 0
+        self.saved_time = 0.0
+
+    def lookup(self, key):
+        return self.results.get(key)
+
+    def put(self, key, result, elapsed=0.0):
+        self.results[key] = result
+        self.elapsed[key] = elapsed
+
+    def count(self, key):
+        # Called once per item; every repeated key is a skipped analysis
+        self.total += 1
+        if key in self.seen:
+            self.saved_time += self.elapsed.get(key, 0.0)
+        else:
+            self.seen.add(key)
+
+    def report(self):
+        if self.total == 0:
+            return
+        unique = len(self.seen)
+        logger.info(self.name + " dedup: " + str(unique) + " unique of " + str(self.total) +
+                    " (dedup ratio " + str(round(1 - unique / self.total, 3)) + "), " +
+                    str(round(self.saved_time, 1)) + "s saved")
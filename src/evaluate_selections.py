@@ -1,54 +1,20 @@
 import sys
 import subprocess
-from IPython import embed
 import os
 import csv
-from collections import Counter
 import matplotlib.pyplot as plt
 import random
+import metric_store
+import scoring
 import pandas
-import numpy as np
 import re
 
 import logging
 import log
-logger = log.init_log(logging.INFO)
+logger = logging.getLogger(__name__)
 
 plt.rcParams.update({'font.size': 13})
 
-def get_logs_for_selected(transpilation_log_dict, selected_functions_list):
-    selected_transpilation_log_dict = {}
-    for line in selected_functions_list:
-        if not line in selected_transpilation_log_dict.keys():
-            selected_transpilation_log_dict[line] = transpilation_log_dict[line]
-
-    return selected_transpilation_log_dict
-
-def get_comp_attempts(transpilation_log_dict):
-
-    comp_attemps = []
-    for k in transpilation_log_dict.keys():
-        comp_attemps.append(transpilation_log_dict[k][4])
-
-    return comp_attemps
-
-def get_frequencies(comp_attempts, selected_comp_attempts):
-    # Normalize the distribution for the original set to overcome differences between two sets
-    ratio = len(selected_comp_attempts) / len(comp_attempts)
-    
-    freq = Counter(comp_attempts)
-    freq = {key: np.ceil(value * ratio) for key, value in freq.items()}
-
-    selected_freq = Counter(selected_comp_attempts)
-
-    all_keys = [str(key) for key in range(0,21)]
-
-    # Get the frequency values for each list (default to 1.0 if the number is not in the list)
-    freq_values = [freq.get(str(key), 1.0) for key in all_keys]
-    selected_freq_values = [selected_freq.get(str(key), 0) for key in all_keys]
-
-    return freq_values, selected_freq_values, all_keys
-
 def draw_histogram(freq_values, selected_freq_values, all_keys, out_file):
 
     fig, ax = plt.subplots()
@@ -68,7 +34,7 @@ def draw_histogram(freq_values, selected_freq_values, all_keys, out_file):
     plt.clf()
     plt.close()
 
-def process_files(transpilation_log_dict, selected_functions_file, out_file):
+def read_selection(selected_functions_file):
 
     with open(selected_functions_file, "r") as f:
         selected_functions_lines = [line.strip() for line in f.readlines()]
@@ -77,21 +43,22 @@ def process_files(transpilation_log_dict, selected_functions_file, out_file):
     # Change the format to match IDs from both file
     selected_functions_list = [line.split(":")[0] + "#" + line.split(":")[1] + "#" + line.split(":")[2] + ".c" for line in selected_functions_lines]
 
-    selected_transpilation_log_dict = get_logs_for_selected(transpilation_log_dict, selected_functions_list)
+    return selected_functions_list, num_of_selected
 
-    comp_attempts = get_comp_attempts(transpilation_log_dict)
-    selected_comp_attempts = get_comp_attempts(selected_transpilation_log_dict)
-    
-    freq_values, selected_freq_values, all_keys = \
-                        get_frequencies(comp_attempts,selected_comp_attempts)
-    
-    # Calculate the relative difference score
-    denom = min(len(freq_values), len(selected_freq_values))
-    relative_diff = (sum((abs(a - b) / a) for a, b in zip(freq_values, selected_freq_values)) / denom) * 100
+def process_files(transpilation_log_dict, selected_functions_file, out_file):
+
+    selected_functions_list, num_of_selected = read_selection(selected_functions_file)
+
+    return process_selection(transpilation_log_dict, selected_functions_list, out_file), num_of_selected
+
+def process_selection(transpilation_log_dict, selected_functions_list, out_file):
+
+    relative_diff, freq_values, selected_freq_values, all_keys = \
+                        scoring.score_selection(transpilation_log_dict, selected_functions_list)
 
     draw_histogram(freq_values, selected_freq_values, all_keys, out_file)
 
-    return relative_diff, num_of_selected
+    return relative_diff
 
 def extract_number(filename):
     
@@ -114,6 +81,7 @@ def draw_diff_plot(out_path, diff_ls, num_of_selected_ls):
     plt.close()
 
 def main():
+    log.init_log(logging.INFO)
     args = sys.argv
     
     if len(args) < 3:
@@ -135,27 +103,21 @@ def main():
         min_diff = sys.maxsize
         min_diff_file = ()
         sorted_diff_ls = []
-        with open(transpilation_log_file, "r") as f:
-            transpilation_log_lines = [line.strip() for line in f.readlines()]
-        
-        all_projs_merged = pandas.read_pickle("large_set_all_metrics.pkl")
-
-        alive_funcs = []
-        for e in list(all_projs_merged["id"]):
-            alive_funcs.append(e.replace(":", "#") + str(".c"))
-
-        transpilation_log_dict = {}
-        for line in transpilation_log_lines:
-            elems = line.split(";")
-            
-            if not elems[0] in transpilation_log_dict.keys() and elems[0] in alive_funcs:
-                transpilation_log_dict[elems[0]] = elems
+        all_projs_merged = metric_store.load_metrics("large_set_all_metrics", [])
+        transpilation_log_dict = scoring.load_transpilation_log(transpilation_log_file, all_projs_merged["id"])
+        # Distribution scores of the other log columns, i.e. whether the selection is representative of the cost
+        column_scorer = scoring.DistributionScorer(scoring.log_column_values(transpilation_log_dict, all_projs_merged["id"]))
+        row_of = pandas.Index(all_projs_merged["id"].map(scoring.log_key))
 
         for selected_functions_file in files:
             logger.info(selected_functions_file)
             out_file = selected_functions_file.replace(".txt", ".pdf")
-            relative_diff, num_of_selected = process_files(transpilation_log_dict, os.path.join(selected_functions_path, selected_functions_file), os.path.join(out_dir, out_file))
+            selected_functions_list, num_of_selected = read_selection(os.path.join(selected_functions_path, selected_functions_file))
+            relative_diff = process_selection(transpilation_log_dict, selected_functions_list, os.path.join(out_dir, out_file))
             logger.info("Diff score: " + str(round(relative_diff,2)))
+            for name, (column_diff, ks, wasserstein) in column_scorer.score(row_of.get_indexer(selected_functions_list)).items():
+                logger.info("  " + name + ": relative diff " + str(round(column_diff, 2)) + "%, KS " + str(round(ks, 3)) +
+                            ", Wasserstein " + str(round(wasserstein, 2)))
 
             diff_ls.append(relative_diff)
             num_of_selected_ls.append(num_of_selected)
@@ -1,10 +1,11 @@
 import sys
 import os
-from IPython import embed
 import evaluate_selections
 import matplotlib.pyplot as plt
-import pandas
+import metric_store
+import scoring
 import logging
+import log
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +37,7 @@ def draw_diff_plot_cross_llm(out_path, diff_ls, model_names):
     plt.close()
 
 def main():
+    log.init_log(logging.INFO)
     args = sys.argv
     
     if len(args) < 3:
@@ -47,10 +49,7 @@ def main():
     selected_functions_path = args[2]
     out_dir = args[3]
 
-    all_projs_merged = pandas.read_pickle("microbenchmark_set_all_metrics.pkl")
-    alive_funcs = []
-    for e in list(all_projs_merged["id"]):
-        alive_funcs.append(e.replace(":", "#") + str(".c"))
+    all_projs_merged = metric_store.load_metrics("microbenchmark_set_all_metrics", [])
     
     files = [file for file in os.listdir(selected_functions_path) if file.endswith(".txt")]
     files.sort(key = evaluate_selections.extract_number)
@@ -66,15 +65,7 @@ def main():
             if not os.path.isdir(selected_functions_path):
                 evaluate_selections.process_files(transpilation_log_file, selected_functions_path)
             else:
-                with open(transpilation_log_file, "r") as f:
-                    transpilation_log_lines = [line.strip() for line in f.readlines()]
-                
-                transpilation_log_dict = {}
-                for line in transpilation_log_lines:
-                    elems = line.split(";")
-
-                    if not elems[0] in transpilation_log_dict.keys() and elems[0] in alive_funcs:
-                        transpilation_log_dict[elems[0]] = elems
+                transpilation_log_dict = scoring.load_transpilation_log(transpilation_log_file, all_projs_merged["id"])
                 diff_dict = {}
                 
                 out_file = model + "_" + selected_functions_file.replace(".txt", ".pdf")
@@ -0,0 +1,253 @@
+import os
+import re
+import sys
+import json
+import math
+import glob
+import time
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+PROGRAM_USAGE = "Usage: \n"\
+                "%prog install [bin_dir] [--latency ccccc=0.2,cargo=1.0,...]\n" \
+                "%prog docker|cargo|rust-code-analysis-cli|dump-unsafe-usage|dump-var-types|add-pub-no-mangle [tool arguments]\n"
+
+# Local stand-ins for the external tools of the pipeline, to load-test the
+# orchestration code without the ccccc container, a Rust toolchain or an
+# Ollama server (see fake_ollama.py). The tools produce plausible outputs in the formats the
+# pipeline parses, after sleeping for a configurable latency:
+#   FAKE_LATENCY_<TOOL>  mean latency in seconds of a call (default 0)
+#   FAKE_LATENCY_JITTER  relative jitter of the latencies (default 0.2)
+#   FAKE_CARGO_FAIL_RATE ratio of failing `cargo rustc` calls (default 0.3)
+tools = ["docker", "cargo", "rust-code-analysis-cli", "dump-unsafe-usage", "dump-var-types", "add-pub-no-mangle"]
+latency_names = ["docker", "ccccc", "cargo", "rustc", "rust-code-analysis", "dump-unsafe-usage", "dump-var-types",
+                 "add-pub-no-mangle", "ollama"]
+
+# The fake tools run once per function like the real ones, so they only import
+# what they need to keep the process start cheap
+
+def latency_env(name):
+    return "FAKE_LATENCY_" + name.upper().replace("-", "_")
+
+def fake_latency(name, factor=1.0):
+    latency = float(os.environ.get(latency_env(name), 0)) * factor
+    if latency > 0:
+        jitter = float(os.environ.get("FAKE_LATENCY_JITTER", 0.2))
+        time.sleep(latency * random.uniform(1 - jitter, 1 + jitter))
+
+def parse_latencies(latency):
+    latencies = {}
+    for x in latency.split(","):
+        if x:
+            name, value = x.split("=")
+            if name not in latency_names:
+                raise ValueError("Unknown tool " + name + ", should be one of " + ", ".join(latency_names))
+            latencies[name] = float(value)
+    return latencies
+
+def install(bin_dir, latencies):
+    # Writes a wrapper script per tool into bin_dir. Put bin_dir first on PATH
+    # and point the *_BIN variables of measure.py to it.
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for tool in tools:
+        with open(os.path.join(bin_dir, tool), "w") as f:
+            f.write("#!/bin/sh\n")
+            for name, value in latencies.items():
+                f.write("export " + latency_env(name) + "=${" + latency_env(name) + ":-" + str(value) + "}\n")
+            f.write("exec \"" + sys.executable + "\" \"" + script + "\" " + tool + " \"$@\"\n")
+        os.chmod(os.path.join(bin_dir, tool), 0o755)
+
+    bin_dir = os.path.abspath(bin_dir)
+    print("export PATH=" + bin_dir + ":$PATH")
+    print("export RUST_CODE_ANALYSIS_BIN=" + os.path.join(bin_dir, "rust-code-analysis-cli"))
+    print("export DUMP_UNSAFE_USAGE_BIN=" + os.path.join(bin_dir, "dump-unsafe-usage"))
+    print("export DUMP_VAR_TYPES_BIN=" + os.path.join(bin_dir, "dump-var-types"))
+    print("export ADD_PUB_NO_MANGLE_BIN=" + os.path.join(bin_dir, "add-pub-no-mangle"))
+
+def code_metrics(code):
+    # (physical LOC, cyclomatic complexity, Halstead volume, maintainability index)
+    loc = len([x for x in code.splitlines() if x.strip()])
+    cyclomatic = 1 + len(re.findall(r"\b(?:if|for|while|case|loop)\b|&&|\|\|", code))
+    tokens = re.findall(r"\w+|[^\s\w]", code)
+    volume = len(tokens) * math.log2(max(2, len(set(tokens))))
+    mi = 171 - 5.2 * math.log(max(1.0, volume)) - 0.23 * cyclomatic - 16.2 * math.log(max(1, loc))
+    return loc, cyclomatic, volume, mi
+
+def rust_functions(code):
+    # (name, signature arguments, body) of every fn, split at the fn keywords
+    starts = [m for m in re.finditer(r"\bfn\s+(\w+)\s*\(([^)]*)\)", code)]
+    functions = []
+    for i, m in enumerate(starts):
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(code)
+        functions.append((m.group(1), m.group(2), code[m.end():end]))
+    return functions
+
+# docker with a single fake ccccc container, the container file system is a local directory
+container_id = "fakeccccc"
+
+def container_root():
+    return os.environ.get("FAKE_CONTAINER_ROOT", os.path.join(tempfile.gettempdir(), "fake_ccccc_container"))
+
+def fake_docker(args):
+    fake_latency("docker")
+    if args[0] == "ps":
+        print(container_id)
+    elif args[0] == "cp":
+        dst = os.path.join(container_root(), args[2].split(":", 1)[1].lstrip("/"))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copyfile(args[1], dst)
+    elif args[0] == "exec":
+        # The command runs ccccc on the copied file (the only .c argument) and removes it
+        c_files = [x for x in args[-1].split() if x.endswith(".c")]
+        for c_file in c_files[:1]:
+            fake_ccccc(os.path.join(container_root(), c_file.lstrip("/")), c_file.lstrip("/"))
+            os.remove(os.path.join(container_root(), c_file.lstrip("/")))
+    return 0
+
+def fake_ccccc(path, name):
+    fake_latency("ccccc")
+    with open(path, "r", errors="replace") as f:
+        code = f.read()
+    m = re.search(r"(\w+)\s*\([^;{]*\)\s*\{", code)
+    # Columns 5, 9, 13 and 20 of the csv template hold LOCphy, MVG, Volume and MI
+    row = [""] * 21
+    row[0] = "Filename"
+    print(";".join(row))
+    if m:
+        loc, cyclomatic, volume, mi = code_metrics(code)
+        row[0], row[4], row[5], row[9], row[13], row[20] = name, m.group(1) + "()", str(loc), str(cyclomatic), \
+            str(round(volume, 2)), str(round(mi, 4))
+        print(";".join(row))
+
+def fake_cargo(args):
+    if args[0] == "new":
+        fake_latency("cargo")
+        os.makedirs(os.path.join(args[1], "src"))
+        with open(os.path.join(args[1], "Cargo.toml"), "w") as f:
+            f.write("[package]\nname = \"" + os.path.basename(args[1]) + "\"\nversion = \"0.1.0\"\nedition = \"2021\"\n\n[dependencies]\n")
+        with open(os.path.join(args[1], "src", "main.rs"), "w") as f:
+            f.write("fn main() {\n    println!(\"Hello, world!\");\n}\n")
+    elif args[0] == "add":
+        fake_latency("cargo")
+        with open("Cargo.toml", "a") as f:
+            for dep in args[1:]:
+                name, version = dep.split("@")
+                f.write(name + " = \"" + version + "\"\n")
+    elif args[0] == "rustc":
+        fake_latency("rustc")
+        with open("Cargo.toml", "r") as f:
+            name = re.search(r"name = \"(\w+)\"", f.read()).group(1)
+        if random.random() < float(os.environ.get("FAKE_CARGO_FAIL_RATE", 0.3)):
+            print("error[E0425]: cannot find value `x` in this scope\n --> src/lib.rs:1:1", file=sys.stderr)
+            print("error: could not compile `" + name + "` due to previous error", file=sys.stderr)
+            return 101
+        os.makedirs(os.path.join("target", "debug"), exist_ok=True)
+        open(os.path.join("target", "debug", "lib" + name + ".so"), "w").close()
+    return 0
+
+def fake_rust_code_analysis(args):
+    path = args[args.index("-p") + 1]
+    out_dir = args[args.index("-o") + 1]
+    pattern = args[args.index("-I") + 1] if "-I" in args else "*.rs"
+    num_jobs = int(args[args.index("-j") + 1]) if "-j" in args else os.cpu_count()
+    rust_files = sorted(glob.glob(os.path.join(path, pattern))) if os.path.isdir(path) else [path]
+
+    for rust_file in rust_files:
+        fake_latency("rust-code-analysis", 1 / num_jobs)
+        with open(rust_file, "r", errors="replace") as f:
+            code = f.read()
+        spaces = []
+        for name, arguments, body in rust_functions(code):
+            loc, cyclomatic, volume, mi = code_metrics(body)
+            spaces.append({"name": name, "kind": "function",
+                           "metrics": {"loc": {"sloc": loc}, "cyclomatic": {"sum": cyclomatic},
+                                       "halstead": {"volume": volume}, "mi": {"mi_original": mi}}})
+        # The output mirrors the input path without the root and with '..' replaced by '.'
+        parts = [x if x != ".." else "." for x in Path(rust_file).parts if x != os.sep]
+        json_file = os.path.join(out_dir, *parts) + ".json"
+        os.makedirs(os.path.dirname(json_file), exist_ok=True)
+        with open(json_file, "w") as f:
+            json.dump({"name": rust_file, "kind": "unit", "spaces": spaces}, f)
+    return 0
+
+def unsafe_blocks(body):
+    # Number of statements of every unsafe block
+    blocks = []
+    for m in re.finditer(r"\bunsafe\s*\{", body):
+        depth, i = 1, m.end()
+        while i < len(body) and depth:
+            depth += {"{": 1, "}": -1}.get(body[i], 0)
+            i += 1
+        blocks.append(body[m.end():i].count(";"))
+    return blocks
+
+def fake_dump_unsafe_usage(args):
+    fake_latency("dump-unsafe-usage")
+    with open(args[0], "r", errors="replace") as f:
+        code = f.read()
+    for name, arguments, body in rust_functions(code):
+        blocks = unsafe_blocks(body)
+        print(";".join([name, str(len(blocks))] + [str(x) for x in blocks]))
+    return 0
+
+def fake_dump_var_types(args):
+    fake_latency("dump-var-types")
+    with open(args[0], "r", errors="replace") as f:
+        code = f.read()
+    for name, arguments, body in rust_functions(code):
+        print("Function;" + name)
+        for arg in [x for x in arguments.split(",") if ":" in x]:
+            arg_name, arg_type = arg.split(":", 1)
+            print("Argument;" + arg_name.strip() + ";" + arg_type.strip())
+        for m in re.finditer(r"\blet\s+(?:mut\s+)?(\w+)\s*:\s*([^=;]+)", body):
+            print("Local;" + m.group(1) + ";" + m.group(2).strip())
+    return 0
+
+def fake_add_pub_no_mangle(args):
+    fake_latency("add-pub-no-mangle")
+    attr = "#[unsafe(no_mangle)]" if "--unsafe" in args else "#[no_mangle]"
+    with open([x for x in args if not x.startswith("--")][0], "r", errors="replace") as f:
+        lines = f.read().splitlines()
+    # Only the unindented functions are top-level
+    out = []
+    for i, line in enumerate(lines):
+        m = re.match(r"(pub(?:\([^)]*\))? )?((?:const |async |unsafe |extern \"C\" )*fn \w+)", line)
+        if m:
+            if not any("no_mangle" in x for x in lines[max(0, i - 3):i]):
+                out.append(attr)
+            line = (m.group(1) or "pub ") + line[m.start(2):]
+        out.append(line)
+    print("\n".join(out))
+    return 0
+
+fake_tools = {
+    "docker": fake_docker,
+    "cargo": fake_cargo,
+    "rust-code-analysis-cli": fake_rust_code_analysis,
+    "dump-unsafe-usage": fake_dump_unsafe_usage,
+    "dump-var-types": fake_dump_var_types,
+    "add-pub-no-mangle": fake_add_pub_no_mangle,
+}
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] in fake_tools:
+        sys.exit(fake_tools[sys.argv[1]](sys.argv[2:]))
+
+    from optparse import OptionParser
+    parser = OptionParser(usage=PROGRAM_USAGE)
+    parser.add_option('--latency', action='store', type='str', default="",
+            help="Mean latencies in seconds, e.g. ccccc=0.2,rustc=1.5. Tools: " + ", ".join(latency_names))
+    opts, args = parser.parse_args()
+
+    if len(args) < 2 or args[0] != "install":
+        parser.print_help()
+        sys.exit(1)
+
+    install(args[1], parse_latencies(opts.latency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import random
+import time
+import datetime
+import threading
+from optparse import OptionParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import fake_backends
+
+import logging
+import log
+logger = logging.getLogger(__name__)
+
+PROGRAM_USAGE = "Usage: \n"\
+                "%prog [--port 11434] [--latency 2.0] [--messy 0.3] [--prompt_eval 0.001]\n"
+
+# Local stand-in for the Ollama chat endpoint used by the transpiler. It answers
+# with a Rust code block after FAKE_LATENCY_OLLAMA seconds: a stub for the C
+# function on a transpilation request, the previous code on a fixing request.
+# A ratio of the answers (FAKE_OLLAMA_MESSY) come in a layout that models often
+# use instead of the requested one: with a leading sentence, a trailing
+# explanation or a ```Rust fence.
+#
+# The prompt evaluation takes FAKE_PROMPT_EVAL_PER_TOKEN seconds per token (words
+# here) that is not in the cache. Like a model server with a single slot, the
+# cache holds the tokens of the last conversation, and the longest common prefix
+# of a request with it is not evaluated again. A request with keep_alive 0
+# unloads the model, i.e. clears the cache.
+
+messy_layouts = [
+    lambda block: "Here is the Rust code:\n\n" + block + "\n",
+    lambda block: block + "\n\nThe function is public and uses `#[no_mangle]`.",
+    lambda block: block.replace("```rust", "```Rust", 1),
+]
+
+def fake_completion(messages):
+    # Returns the last Rust code of the conversation, or a stub for the C function
+    # of the request, in a rust code block
+    request = messages[-1]["content"]
+    rust_code = re.findall(r"```rust\n(.*?)```", "".join(x["content"] for x in messages if x["role"] == "assistant"), re.S | re.I)
+    if rust_code:
+        # Compilation fixing, the code is returned unchanged
+        code = rust_code[-1]
+    elif "#[no_mangle]" in request:
+        # Post-processing of Rust code, given as "\n<code>\n<instruction>\n"
+        code = request.strip("\n").rsplit("\n", 1)[0]
+    else:
+        m = re.search(r"(\w+)\s*\([^;{]*\)\s*\{", request)
+        name = m.group(1) if m else "func"
+        code = "#[no_mangle]\npub extern \"C\" fn " + name + "() -> i32 {\n    0\n}\n"
+    block = "```rust\n" + code.strip("\n") + "\n```"
+    if random.random() < float(os.environ.get("FAKE_OLLAMA_MESSY", 0)):
+        return random.choice(messy_layouts)(block)
+    return block
+
+def prompt_tokens(messages):
+    tokens = []
+    for message in messages:
+        tokens.append("<" + message["role"] + ">")
+        tokens += message["content"].split()
+    return tokens
+
+prompt_cache = {"model": None, "tokens": []}
+prompt_cache_lock = threading.Lock()
+
+def evaluate_prompt(model, tokens, keep_alive):
+    # Number of tokens to evaluate and the seconds it takes, with the prompt cache
+    with prompt_cache_lock:
+        cached = 0
+        if prompt_cache["model"] == model:
+            for a, b in zip(prompt_cache["tokens"], tokens):
+                if a != b:
+                    break
+                cached += 1
+        unloaded = keep_alive is not None and re.fullmatch(r"0*\.?0*[a-z]*", str(keep_alive)) is not None
+        prompt_cache["model"] = None if unloaded else model
+        prompt_cache["tokens"] = [] if unloaded else tokens
+    evaluated = len(tokens) - cached
+    return evaluated, evaluated * float(os.environ.get("FAKE_PROMPT_EVAL_PER_TOKEN", 0))
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        start_time = time.time()
+        fake_backends.fake_latency("ollama")
+        if self.path == "/api/chat":
+            content = fake_completion(request["messages"])
+            tokens = prompt_tokens(request["messages"])
+            prompt_eval_count, prompt_eval_time = evaluate_prompt(request["model"], tokens, request.get("keep_alive"))
+            prompt_eval_start = time.time()
+            time.sleep(prompt_eval_time)
+            # The answer is part of the conversation the next request continues
+            with prompt_cache_lock:
+                if prompt_cache["tokens"] is tokens:
+                    prompt_cache["tokens"] = tokens + prompt_tokens([{"role": "assistant", "content": content}])
+            prompt_eval_ns = int((time.time() - prompt_eval_start) * 1e9)
+            elapsed_ns = int((time.time() - start_time) * 1e9)
+            response = {"model": request["model"],
+                        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                        "message": {"role": "assistant", "content": content},
+                        "done": True, "done_reason": "stop",
+                        "total_duration": elapsed_ns, "load_duration": 0,
+                        "prompt_eval_count": prompt_eval_count, "prompt_eval_duration": prompt_eval_ns,
+                        "eval_count": len(content.split()), "eval_duration": elapsed_ns - prompt_eval_ns}
+            body = json.dumps(response).encode()
+            self.send_response(200)
+        else:
+            body = json.dumps({"error": "unsupported endpoint " + self.path}).encode()
+            self.send_response(404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def serve_ollama(port, latency, messy=0.0, prompt_eval=0.0):
+    # Point the ollama client to it with OLLAMA_HOST=127.0.0.1:<port>
+    os.environ.setdefault(fake_backends.latency_env("ollama"), str(latency))
+    os.environ.setdefault("FAKE_OLLAMA_MESSY", str(messy))
+    os.environ.setdefault("FAKE_PROMPT_EVAL_PER_TOKEN", str(prompt_eval))
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOllamaHandler)
+    logger.info("Fake Ollama server listening on 127.0.0.1:" + str(port))
+    server.serve_forever()
+
+def start_ollama():
+    # Serves on a free port from a daemon thread of the calling process, the
+    # behaviour is set with the FAKE_* environment variables
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+
+    parser = OptionParser(usage=PROGRAM_USAGE)
+    parser.add_option('--port', action='store', type='int', default=11434,
+            help="Port to listen on")
+    parser.add_option('--latency', action='store', type='float', default=0.0,
+            help="Mean latency in seconds of a chat request")
+    parser.add_option('--messy', action='store', type='float', default=0.0,
+            help="Ratio of the answers in another layout than a bare rust code block")
+    parser.add_option('--prompt_eval', action='store', type='float', default=0.0,
+            help="Seconds per prompt token that is not in the prompt cache")
+    opts, args = parser.parse_args()
+
+    log.init_log(logging.INFO)
+    serve_ollama(opts.port, opts.latency, opts.messy, opts.prompt_eval)
+
+if __name__ == "__main__":
+    main()
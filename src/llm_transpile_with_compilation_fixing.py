@@ -1,54 +1,136 @@
-
 import os
+import re
 import sys
-import shutil
-import subprocess
 import traceback
+import threading
+import concurrent.futures
 import tempfile
+import shutil
 from pathlib import Path
 
 import time
-from IPython import embed
 from textwrap import wrap
+from optparse import OptionParser
+import numpy as np
 import toml
 import ollama
-
+import httpx
+
+import logging
+import log
+import dedup
+import scoring
+import tool_runner
+logger = logging.getLogger(__name__)
+
+PROGRAM_USAGE = "Usage: \n"\
+                "%prog -d [main_benchmark_dir]\n" \
+                "%prog -d [main_benchmark_dir] -s [selection_file] [-f metricfile]\n"
+
+translation_rules = ["Do not add any extra error handling",
+                     "Do not merge functions",
+                     "Do not change variable names",
+                     "use no_mangle for each function",
+                     "make each function public",
+                     "translate the standard C library function calls by placing a decoy function call (leave the decoy function body empty if possible) with the same name",
+                     "Only return a Rust code and nothing else!"]
+
+def format_rules(rules):
+    numbered = ["(" + str(i) + ") " + rule for i, rule in enumerate(rules, 1)]
+    return ", \n".join(numbered[:-1]) + ", and \n" + numbered[-1] + "\n"
+
+# The instructions follow the C code in the user message (suffix layout), or come
+# first in a system message (prefix layout) with the same text, so that only the
+# position and role of the instructions differ between the layouts
 instructions = "Behave like you are an expert of C and Rust. Behave like you are a translator from C language to Rust language. Can you translate C code given above into Rust code? \n" +\
                     "Do not explain the code to me! Only return Rust code correspoding to the given C code. " +\
                     "Follow these intructions strictly in translation: \n" +\
-                    "(1) Do not add any extra error handling, \n" +\
-                    "(2) Do not merge functions, \n" +\
-                    "(3) Do not change variable names, \n" +\
-                    "(4) use no_mangle for each function, \n" +\
-                    "(5) make each function public, \n" +\
-                    "(6) translate the standard C library function calls by placing a decoy function call (leave the decoy function body empty if possible) with the same name, and \n" +\
-                    "(7) Only return a Rust code and nothing else!\n"
+                    format_rules(translation_rules)
 
 fix_compilation_inst = "When attempted to compile the recently generated rust code, I obtained the compilation errors given above. Fix those errors and only return the modified Rust code. Do not explain the code or changes to me!"
 
 no_mangle_and_pub_inst = "Make a pass on the code given above and add #[no_mangle] and pub to each functions if they are missing. Do not change anything else. Only return a Rust code and nothing else!\n"
 
-BASE_DIR = os.getcwd()
-
 ## Tested models
 # llama3.1:8b, gemma2:9b, mistral:7b, llama3.2:3b, codegeex4:9b
 # codestral:22b, qwen2.5:7b, qwen2.5:14b, qwen2.5:32b
 
 MODEL = "qwen2.5-coder:7b"
-def llm_request(req_text, messages):
+ADD_PUB_NO_MANGLE_BIN = os.environ.get("ADD_PUB_NO_MANGLE_BIN", "src/bin/add-pub-no-mangle")
+# Whether the add-pub-no-mangle tool is used, it is looked up once at startup
+REWRITE_PUB_NO_MANGLE = True
+client = ollama.Client(timeout=tool_runner.get_timeout("ollama"))
+
+# Prompt layout (suffix: C code then instructions in the user message, prefix:
+# instructions in a system message first), how long the server keeps the model
+# loaded and the model options (e.g. num_ctx) of every request, set from the options
+PROMPT_LAYOUT = "suffix"
+KEEP_ALIVE = None
+LLM_OPTIONS = None
+
+# (prompt_eval_count, prompt_eval_duration in s) of every request, as reported by the server
+prompt_evals = []
+
+def llm_request(req_text, messages, options=None):
+    # options override LLM_OPTIONS for this request
     print("Waiting for response...")
     current_message = [{
                         "role": "user",
                         "content": req_text,
                     }]
     
-    response = ollama.chat(
+    response = tool_runner.call_tool("ollama", client.chat,
         model=MODEL,
         messages=messages + current_message,
+        options=dict(LLM_OPTIONS or {}, **options) if options else LLM_OPTIONS,
+        keep_alive=KEEP_ALIVE,
+        item=MODEL,
+        timeout_errors=(httpx.TimeoutException,),
     )
+    prompt_evals.append((response.get("prompt_eval_count") or 0, (response.get("prompt_eval_duration") or 0) / 1e9))
     
     return response, current_message + [response['message']]
 
+def report_prompt_evals():
+    if not prompt_evals:
+        return
+    durations = sorted(x[1] for x in prompt_evals)
+    logger.info("Prompt eval (" + PROMPT_LAYOUT + " layout): " + str(len(prompt_evals)) + " requests, " +
+                str(round(sum(x[0] for x in prompt_evals) / len(prompt_evals), 1)) + " tokens per request, p50 " +
+                str(round(tool_runner.percentile(durations, 50) * 1000, 1)) + " ms, p95 " +
+                str(round(tool_runner.percentile(durations, 95) * 1000, 1)) + " ms, total " + str(round(sum(durations), 1)) + "s")
+
+# Fenced code blocks of a response: the info string (language) and the code. The
+# closing fence may be missing when the response was cut off.
+CODE_BLOCK_RE = re.compile(r"^[ \t]*```[ \t]*([\w+#-]*)[^\n]*\n(.*?)(?:^[ \t]*```[ \t]*$|\Z)", re.S | re.M)
+# First line of a response given as bare Rust code, without a fence
+RUST_START_RE = re.compile(r"\s*(?://|/\*|#!?\[|(?:pub(?:\([^)]*\))?\s+)?(?:use|fn|const|static|struct|enum|type|impl|mod|extern|unsafe|trait)\b)")
+# A function definition, which the code of every translation has (unlike prose
+# that happens to start with a keyword such as "unsafe")
+RUST_FN_RE = re.compile(r"\bfn\s+\w+\s*(?:<[^>]*>)?\s*\(.*?\)[^;{}]*\{", re.S)
+
+# How the code was taken from the responses: in one of the expected layouts,
+# extracted from any other layout (a regeneration avoided) or not found (TryAgain)
+code_block_counts = {"expected": 0, "extracted": 0, "not found": 0}
+
+def looks_like_rust(code):
+    return RUST_START_RE.match(code) is not None and RUST_FN_RE.search(code) is not None
+
+def extract_rust_code(response_text):
+    # The Rust code of a response in any layout: the longest block tagged as Rust
+    # (```rust, ```Rust, ```rs), else the longest untagged block that looks like
+    # Rust, else the whole response if it is bare Rust code. Untagged and bare code
+    # must define a function. None if there is none.
+    blocks = CODE_BLOCK_RE.findall(response_text)
+    rust_blocks = [code for lang, code in blocks if lang.lower() in ["rust", "rs"] and code.strip()]
+    if not rust_blocks:
+        rust_blocks = [code for lang, code in blocks if not lang and looks_like_rust(code)]
+    if rust_blocks:
+        return max(rust_blocks, key=len)
+    if "```" not in response_text and looks_like_rust(response_text):
+        return response_text
+    return None
+
 def check_format_and_clean(transpiled_rust_code):
     if transpiled_rust_code[:8] == "```rust\n" and transpiled_rust_code[-3:] == "```":
         transpiled_rust_code = transpiled_rust_code[8:]
@@ -63,16 +145,41 @@ def check_format_and_clean(transpiled_rust_code):
         transpiled_rust_code = transpiled_rust_code[9:]
         transpiled_rust_code = transpiled_rust_code[:-3]
     else:
+        # Any other layout, e.g. with a leading sentence or a trailing explanation
+        extracted = extract_rust_code(transpiled_rust_code)
+        if extracted is not None:
+            code_block_counts["extracted"] += 1
+            return extracted
+        code_block_counts["not found"] += 1
         print("The returned format unrecognized!")
         print(transpiled_rust_code)
-        transpiled_rust_code = "TryAgain"
+        return "TryAgain"
 
+    code_block_counts["expected"] += 1
     return transpiled_rust_code
 
-def transpile_with_chatgpt_web(input_C):
-
-    input_text = "\n" + input_C + "\n" + instructions
-    response, messages = llm_request(input_text, [])
+def report_code_blocks():
+    total = sum(code_block_counts.values())
+    if total == 0:
+        return
+    # Every extracted code block saved a whole LLM round trip
+    ollama_latencies = tool_runner.latencies.get("ollama", [])
+    mean_latency = sum(ollama_latencies) / len(ollama_latencies) if ollama_latencies else 0.0
+    logger.info("Code blocks: " + str(total) + " responses, " + str(code_block_counts["expected"]) + " in the expected layout, " +
+                str(code_block_counts["extracted"]) + " extracted from another layout (regenerations avoided, ~" +
+                str(round(code_block_counts["extracted"] * mean_latency, 1)) + "s saved), " +
+                str(code_block_counts["not found"]) + " without Rust code (regenerated)")
+
+def transpile_with_chatgpt_web(input_C, options=None):
+
+    if PROMPT_LAYOUT == "prefix":
+        # The system message stays in the conversation of the compilation fixing requests
+        system_message = [{"role": "system", "content": instructions}]
+        response, messages = llm_request("\n" + input_C + "\n", system_message, options)
+        messages = system_message + messages
+    else:
+        input_text = "\n" + input_C + "\n" + instructions
+        response, messages = llm_request(input_text, [], options)
     
     if not response:
         return False
@@ -85,53 +192,46 @@ def transpile_with_chatgpt_web(input_C):
 
     return transpiled_rust_code, messages
 
+# Edition of the scratch projects of is_compilable, i.e. the default of cargo new
+scratch_edition = None
+
 def _update_cargo_toml(toml_path):
+    global scratch_edition
     
     toml_data = toml.load(toml_path)
+    scratch_edition = toml_data.get("package", {}).get("edition", scratch_edition)
     if "lib" in toml_data.keys():
         if not "crate-type" in toml_data["lib"].keys():
             toml_data["lib"]["crate-type"] = ["cdylib"]
     else:
         toml_data["lib"] = {"crate-type":["cdylib"]}
-    with open("Cargo.toml", "w") as f:
+    with open(toml_path, "w") as f:
         toml.dump(toml_data, f)
 
 def is_compilable(Input_C):
-
+    # The cargo commands run in a scratch project with their own time budget,
+    # a ToolTimeout is raised if a command stalls
     print("Test Rust compilation")
 
-    tmp_dir = tempfile.TemporaryDirectory()
-    os.chdir(tmp_dir.name)
-    with open("tmp.rs", 'w') as f:
-        f.write(Input_C + "\n")
-        
     cargo_proj_name = "tmp_proj_dir"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        proj_dir = os.path.join(tmp_dir, cargo_proj_name)
+        tool_runner.run_tool("cargo", ["cargo", "new", cargo_proj_name], cwd=tmp_dir)
 
-    if not os.path.exists(cargo_proj_name):
-        cmd = ["cargo", "new", cargo_proj_name]
-        subprocess.run(cmd)
+        os.remove(os.path.join(proj_dir, "src", "main.rs"))
+        with open(os.path.join(proj_dir, "src", "lib.rs"), 'w') as f:
+            f.write(Input_C + "\n")
 
-    shutil.copy("tmp.rs", os.path.join(cargo_proj_name, "src", "main.rs"))
+        tool_runner.run_tool("cargo", ["cargo", "add", "libc@0.2", "f128@0.2"], cwd=proj_dir)
 
-    shutil.move(os.path.join(cargo_proj_name, "src", "main.rs"), os.path.join(cargo_proj_name, "src", "lib.rs"))
-    os.chdir(cargo_proj_name)
-    
-    cmd = ["cargo", "add", "libc@0.2", "f128@0.2"]
-    subprocess.run(cmd)
-
-    _update_cargo_toml("Cargo.toml")
-
-    cmd = ["cargo", "rustc", "--", "-C", "opt-level=0", "-C", "overflow-checks=off"]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, err = process.communicate()
-    if os.path.exists(os.path.join("target/debug/", "lib" + cargo_proj_name + ".so")):
-        os.chdir(BASE_DIR)
-        shutil.rmtree(tmp_dir.name)
-        print("Compilation is successful")
-        return True, None
+        _update_cargo_toml(os.path.join(proj_dir, "Cargo.toml"))
+
+        cmd = ["cargo", "rustc", "--", "-C", "opt-level=0", "-C", "overflow-checks=off"]
+        returncode, output, err = tool_runner.run_tool("rustc", cmd, cwd=proj_dir)
+        if os.path.exists(os.path.join(proj_dir, "target/debug/", "lib" + cargo_proj_name + ".so")):
+            print("Compilation is successful")
+            return True, None
     
-    os.chdir(BASE_DIR)
-    shutil.rmtree(tmp_dir.name)
     print("Compilation is failed")
     return False, err.decode("utf-8")
 
@@ -171,12 +271,15 @@ def fix_pub_no_mangle(input_Rust):
     else:
         return final_rust_code, messages
 
-def transpilation(input_C):
+def transpilation(input_C, options=None, cancelled=None):
     try_count = 0
+    output_Rust, messages = '', []
     while try_count < 5:
+        if cancelled is not None and cancelled.is_set():
+            return '', []
         print("Transpilation...")
         messages = []
-        output_Rust, messages = transpile_with_chatgpt_web(input_C)
+        output_Rust, messages = transpile_with_chatgpt_web(input_C, options)
         # print(messages)
         print(output_Rust)
         if output_Rust != "TryAgain":
@@ -185,11 +288,67 @@ def transpilation(input_C):
         try_count = try_count + 1
     return output_Rust, messages
 
-def check_and_fix_compilation(output_Rust, messages):
+def speculative_transpilation(input_C, num_candidates):
+    # Generates num_candidates translations concurrently and compile-checks each one
+    # as soon as it is generated. The first candidate uses the settings of the serial
+    # transpilation, the others a different seed each. The first candidate that
+    # compiles wins and the others are cancelled at their next request or compilation,
+    # which is waited for.
+    # Returns the code and messages of the winner, or of the first candidate that was
+    # generated and compiled if none compiles, with its (res, err) compilation result
+    # and the number of the other candidates that failed to compile.
+    cancelled = threading.Event()
+
+    def candidate(index):
+        options = {"seed": index} if index > 0 else None
+        output_Rust, messages = transpilation(input_C, options, cancelled)
+        if output_Rust == '' or cancelled.is_set():
+            return output_Rust, messages, None
+        return output_Rust, messages, is_compilable(output_Rust)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_candidates)
+    futures = {executor.submit(candidate, index): index for index in range(num_candidates)}
+    candidates = {}
+    error = None
+    winner = None
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            output_Rust, messages, compile_result = future.result()
+        except Exception as ex:
+            logger.warning("Candidate " + str(futures[future]) + " failed: " + str(ex))
+            error = ex
+            continue
+        if compile_result is None:
+            continue
+        candidates[futures[future]] = (output_Rust, messages, compile_result)
+        if compile_result[0]:
+            winner = futures[future]
+            break
+    # The running candidates stop before their next request or compilation, so they
+    # do not compete with the next function
+    cancelled.set()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+    if winner is None:
+        if not candidates:
+            if error is not None:
+                raise error
+            return '', [], None, 0
+        winner = next(iter(candidates))
+    output_Rust, messages, compile_result = candidates[winner]
+    print("Candidate " + str(winner) + " of " + str(num_candidates) + (" compiles" if compile_result[0] else " is fixed"))
+    return output_Rust, messages, compile_result, len(candidates) - 1
+
+def check_and_fix_compilation(output_Rust, messages, compile_result=None):
+    # compile_result is the (res, err) of output_Rust if it was compiled already
     fix_count = 0
     while fix_count < 20:
         print("Check compilation..")
-        res, err = is_compilable(output_Rust)
+        if compile_result is not None:
+            res, err = compile_result
+            compile_result = None
+        else:
+            res, err = is_compilable(output_Rust)
         if not res:
             try_count = 0
             while try_count < 5:
@@ -228,105 +387,386 @@ def check_pub_no_mangle(output_Rust):
     else:
         return output_Rust, try_count + 1
 
-def main():
-
-    args = sys.argv
-    
-    if len(args) < 1:
-        print("Error: Missing argument")
-        print("Usage: python3 src/llm_transpile_with_compilation_fixing.py Benchmark/large_set/")
+def rewrite_pub_no_mangle(output_Rust):
+    # Adds the missing pub and #[no_mangle] to the top-level functions with the
+    # add-pub-no-mangle tool, without a model generation, and compiles the result
+    # if it changed (e.g. a new #[no_mangle] may clash with another symbol).
+    # Returns None if the code cannot be parsed or the result does not compile.
+    cmd = [ADD_PUB_NO_MANGLE_BIN]
+    # From edition 2024 on, no_mangle is an unsafe attribute
+    if scratch_edition is not None and scratch_edition >= "2024":
+        cmd.append("--unsafe")
+    with tempfile.NamedTemporaryFile("w", suffix=".rs") as f:
+        f.write(output_Rust)
+        f.flush()
+        try:
+            returncode, out, err = tool_runner.run_tool("add-pub-no-mangle", cmd + [f.name], item=f.name)
+        except OSError as ex:
+            logger.warning("Cannot run " + ADD_PUB_NO_MANGLE_BIN + ": " + str(ex))
+            return None
+    if returncode != 0:
+        logger.warning("add-pub-no-mangle failed: " + err.decode("utf-8", errors="replace").strip())
+        return None
+    rewritten_Rust = out.decode("utf-8")
+    if rewritten_Rust != output_Rust:
+        print("Check compilation..")
+        res, err = is_compilable(rewritten_Rust)
+        if not res:
+            logger.warning("The code with pub and #[no_mangle] added does not compile")
+            return None
+    return rewritten_Rust
+
+def parse_args():
+    """Parse and validate command line arguments."""
+    parser = OptionParser(usage=PROGRAM_USAGE)
+
+    parser.add_option('-d', '--dir', action='store', type='str',
+            default=None, help="Main benchmark directory")
+    parser.add_option('-s', '--selection', action='store', type='str',
+            default=None, help="Selection file (selected_funcs#...txt) of the functions to transpile, instead of all functions")
+    parser.add_option('-f', '--metricfile', action='store', type='str',
+            default=None, help="Metric file of the benchmark, to transpile the selected functions in increasing PCA complexity order")
+    parser.add_option('--llm_post_process', action='store_true', default=False,
+            help="Add pub and #[no_mangle] with the LLM pass when the add-pub-no-mangle tool is missing, or its rewrite cannot parse the code or does not compile")
+    parser.add_option('--prompt_layout', action='store', type='str',
+            default="suffix", help="Layout of the transpilation prompt. Options: suffix (C code, then instructions), prefix (instructions in a fixed system message first, for prompt cache reuse)")
+    parser.add_option('--keep_alive', action='store', type='str',
+            default=None, help="How long the model server keeps the model (and its prompt cache) loaded after a request, e.g. 30m or -1 for ever (default: server setting)")
+    parser.add_option('--llm_options', action='store', type='str',
+            default=None, help="Model options of every request, e.g. num_ctx=8192,num_keep=512")
+    parser.add_option('--candidates', action='store', type='int',
+            default=1, help="Number of candidate translations generated and compiled concurrently, the first that compiles is kept (default: 1, serial)")
+    parser.add_option('--progressive', action='store_true', default=False,
+            help="Transpile the selection in a random order stratified by PCA complexity (with -f) and stop once the comp_attempt histogram estimate is stable")
+    parser.add_option('--tolerance', action='store', type='float',
+            default=2.0, help="Upper confidence bound of the error of the estimate to stop at, in percent")
+    parser.add_option('--stop_on', action='store', type='str',
+            default="histogram", help="Error the tolerance applies to. Options: histogram (largest error of an attempt count share), score (relative difference score)")
+    parser.add_option('--min_functions', action='store', type='int',
+            default=30, help="Number of functions transpiled before the progressive evaluation may stop")
+    parser.add_option('--seed', action='store', type='int',
+            default=0, help="Random seed of the progressive order and of the confidence bounds")
+
+    opts, args = parser.parse_args()
+
+    # The benchmark directory used to be the only, positional, argument
+    if opts.dir is None and args:
+        opts.dir = args[0]
+    if opts.dir is None:
+        parser.print_help()
+        print("Main benchmark directory must be set", file=sys.stderr)
+        sys.exit(1)
+    if opts.metricfile is not None and opts.selection is None:
+        parser.print_help()
+        print("The metric file is only used to order a selection", file=sys.stderr)
+        sys.exit(1)
+    if opts.progressive and opts.selection is None:
+        parser.print_help()
+        print("The progressive evaluation requires a selection", file=sys.stderr)
+        sys.exit(1)
+    if opts.candidates < 1:
+        parser.print_help()
+        print("The number of candidates must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    if opts.candidates > 1 and opts.progressive:
+        parser.print_help()
+        print("The progressive evaluation requires the attempts of a single candidate", file=sys.stderr)
+        sys.exit(1)
+    if opts.prompt_layout not in ["suffix", "prefix"]:
+        parser.print_help()
+        print("The prompt layout should be one of these: suffix, prefix", file=sys.stderr)
+        sys.exit(1)
+    if opts.stop_on not in ["histogram", "score"]:
+        parser.print_help()
+        print("The stopping error should be one of these: histogram, score", file=sys.stderr)
         sys.exit(1)
-    
-    input_C = ""
-    llm_model = "qwen2_5_coder_32b"
-    DATASET_ROOT = args[1]
-    projects = [x for x in os.listdir(DATASET_ROOT) if os.path.isdir(os.path.join(DATASET_ROOT, x))]
 
+    return (opts, args)
+
+def parse_keep_alive(keep_alive):
+    # Seconds as a number, durations such as 30m as they are
+    if keep_alive is None:
+        return None
+    try:
+        return float(keep_alive)
+    except ValueError:
+        return keep_alive
+
+def parse_llm_options(llm_options):
+    # "name=value,..." into a dict of numbers (or strings)
+    if not llm_options:
+        return None
+    options = {}
+    for option in llm_options.split(","):
+        name, value = option.split("=", 1)
+        for convert in [int, float, str]:
+            try:
+                options[name.strip()] = convert(value.strip())
+                break
+            except ValueError:
+                pass
+    return options
+
+def read_selection(selection_file):
+    with open(selection_file, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def complexity_scores(metricfile):
+    # PCA summary complexity of main.py per function id
+    import main as funcselector
+    import measure
+    import metric_store
+
+    df = metric_store.load_metrics(metricfile, funcselector.chosen_metrics)
+    scores = measure.get_summary_complexity(df, funcselector.chosen_metrics, metricfile)
+    return dict(zip(df["id"], scores))
+
+def order_by_complexity(ids, score_of):
+    # Least complex functions first, so that the cheap transpilations finish early
+    missing = [x for x in ids if x not in score_of]
+    if missing:
+        logger.warning(str(len(missing)) + " selected functions have no complexity score, they are transpiled last")
+    return sorted(ids, key=lambda x: (x not in score_of, score_of.get(x, 0.0), x))
+
+def stratified_order(ids, score_of, seed, num_strata=10):
+    # Random order in which every prefix holds about the same share of each
+    # complexity stratum (deciles of the selection, and one for the functions
+    # without a score). Returns the ordered ids and their strata.
+    rng = np.random.default_rng(seed)
+    ids = sorted(ids, key=lambda x: (x not in score_of, score_of.get(x, 0.0), x))
+    num_scored = len([x for x in ids if x in score_of])
+    strata = np.array([i * num_strata // num_scored if i < num_scored else num_strata for i in range(len(ids))], dtype=np.int64)
+
+    keys = np.empty(len(ids))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        keys[members] = (rng.permutation(len(members)) + rng.random()) / len(members)
+    order = np.argsort(keys, kind="stable")
+    return [ids[i] for i in order], strata[order]
+
+def selected_file(dataset_root, id):
+    # (project, C file) of a selected proj:file:func id
+    proj_name, filename, funcname = id.split(":")
+    input_dir = os.path.join(dataset_root, proj_name, "preprocessed_sf")
+    for file in [proj_name + "#" + filename + "#" + funcname + ".c", filename + "#" + funcname + ".c"]:
+        if os.path.exists(os.path.join(input_dir, file)):
+            return (proj_name, file)
+    logger.warning("No C file found for the selected function " + id)
+    return None
+
+def logged_attempts(transpilation_log_file):
+    # comp_attempt of every file already in a transpilation log
+    attempts = {}
+    if os.path.exists(transpilation_log_file):
+        with open(transpilation_log_file, "r") as f:
+            for line in f:
+                elems = line.strip().split(";")
+                scoring.check_log_fields(transpilation_log_file, elems)
+                if len(elems) > 4 and elems[0] not in attempts:
+                    attempts[elems[0]] = elems[4]
+    return attempts
+
+def all_files(dataset_root):
+    files = []
+    projects = [x for x in os.listdir(dataset_root) if os.path.isdir(os.path.join(dataset_root, x))]
     for proj_name in projects:
+        files += [(proj_name, x) for x in os.listdir(os.path.join(dataset_root, proj_name, "preprocessed_sf"))]
+    return files
+
+def transpile_file(file, INPUT_DIR, OUT_DIR, log_file, transpile_cache, llm_post_process=False, num_candidates=1):
+    print("Processing: " + str(file))
+    # Returns the log fields of the transpilation, None if it failed or was already done
+    if os.path.exists(os.path.join(OUT_DIR, os.path.splitext(file)[0] + '.rs')):
+        print("Already analyzed, Skipping!")
+        return None
+    with open(os.path.join(INPUT_DIR, file), "r") as fp:
+        try:
+            input_C = fp.read()
+        except Exception as ex:
+            print("Error in reading Input C file: " + str(traceback.format_exc()))
+            log_file.write(str(file) + ": " + str(ex).replace("\n", " ") + "\n")
+            return None
+    digest = dedup.text_digest(input_C)
+    cached = transpile_cache.lookup(digest)
+    if cached is not None:
+        transpile_cache.count(digest)
+        output_Rust, log_fields = cached
+        with open(os.path.join(OUT_DIR, os.path.splitext(file)[0] + '.rs'), "w") as fp:
+            fp.write(output_Rust)
+        print(str(file) + ": " + "Reused the transpilation of an identical function" + "\n")
+        log_file.write(str(file) + ";" + log_fields + "\n")
+        log_file.flush()
+        return log_fields
+
+    transpilation_res = None
+    compilation_res = None
+    number_of_compilation_iteration = 0
+    number_of_post_process_iter = 0
+    transpilation_time = 0
+    compilation_fixing_time = 0
+    post_process_fixing_time = 0
+    start_file_time = time.time()
+    if input_C:
+        try:
+            while True:
+                transpilation_res = None
+                compilation_res = None
+                number_of_compilation_iteration = 0
+                number_of_post_process_iter = 0
+                transpilation_time = 0
+                compilation_fixing_time = 0
+                post_process_fixing_time = 0
+
+                start_time = time.time()
+                messages = []
+                compile_result, failed_candidates = None, 0
+                if num_candidates > 1:
+                    output_Rust, messages, compile_result, failed_candidates = speculative_transpilation(input_C, num_candidates)
+                else:
+                    output_Rust, messages = transpilation(input_C)
+                end_time = time.time()
+                transpilation_time = round(end_time - start_time)
+                if output_Rust == '':
+                    transpilation_res = False
+                else:
+                    transpilation_res = True
+                    start_time = time.time()
+                    output_Rust, fix_count, res = check_and_fix_compilation(output_Rust, messages, compile_result)
+                    end_time = time.time()
+                    compilation_fixing_time = round(end_time - start_time)
+                    number_of_compilation_iteration = fix_count
+                    if res:
+                        compilation_res = True
+                    else:
+                        compilation_res = False
+                        break
+
+                if output_Rust == '':
+                    continue
+                else:
+                    start_time = time.time()
+                    # The deterministic rewrite makes no post-process iteration
+                    rewritten_Rust = rewrite_pub_no_mangle(output_Rust) if REWRITE_PUB_NO_MANGLE else None
+                    if rewritten_Rust is not None:
+                        output_Rust, fix_count = rewritten_Rust, 0
+                    elif llm_post_process:
+                        output_Rust, fix_count = check_pub_no_mangle(output_Rust)
+                    else:
+                        fix_count = 0
+                    end_time = time.time()
+                    post_process_fixing_time = round(end_time - start_time)
+                    number_of_post_process_iter = fix_count
+                    break
+        except Exception as ex:
+            print("Error in transpilation: " + str(traceback.format_exc()))
+            log_file.write(str(file) + ": " + str(ex).replace("\n", " ") + "\n")
+            return None
+    else:
+        print("Input file is empty!")
+        log_file.write(str(file) + ": " + "Input file is empty!" + "\n")
+        return None
+
+    end_time = time.time()
+    with open(os.path.join(OUT_DIR, os.path.splitext(file)[0] + '.rs'), "w") as fp:
+        fp.write(output_Rust)
+
+    print(str(file) + ": " + "Successful transpilation!" + "\n")
+    log_fields = str(transpilation_res) + ";" + str(compilation_res) + ";"  +\
+                    str(transpilation_time) + ";" + str(number_of_compilation_iteration) + ";" +\
+                    str(compilation_fixing_time) + ";" + str(number_of_post_process_iter) + ";" +\
+                    str(post_process_fixing_time)
+    if num_candidates > 1:
+        # The attempts are those of the best candidate, which are lower than in a
+        # serial run, so the candidates are logged in trailing fields that keep the
+        # log from being scored (see scoring.check_log_fields)
+        log_fields += ";" + str(num_candidates) + ";" + str(failed_candidates)
+    log_file.write(str(file) + ";" + log_fields + "\n")
+    log_file.flush()
+    transpile_cache.put(digest, (output_Rust, log_fields), end_time - start_file_time)
+    transpile_cache.count(digest)
+    return log_fields
+
+def format_interval(interval):
+    median, lower, upper = interval
+    return str(round(median, 2)) + "% [" + str(round(lower, 2)) + ", " + str(round(upper, 2)) + "]"
+
+def main():
+
+    global PROMPT_LAYOUT, KEEP_ALIVE, LLM_OPTIONS, REWRITE_PUB_NO_MANGLE
+    opts, args = parse_args()
+    log.init_log(logging.INFO)
+    if shutil.which(ADD_PUB_NO_MANGLE_BIN) is None:
+        # Without the tool, the functions would silently not be exported
+        if not opts.llm_post_process:
+            logger.error(ADD_PUB_NO_MANGLE_BIN + " not found, build it (see README) or add pub and #[no_mangle] with the LLM pass (--llm_post_process)")
+            sys.exit(1)
+        logger.warning(ADD_PUB_NO_MANGLE_BIN + " not found, pub and #[no_mangle] are added by the LLM pass")
+        REWRITE_PUB_NO_MANGLE = False
+    PROMPT_LAYOUT = opts.prompt_layout
+    KEEP_ALIVE = parse_keep_alive(opts.keep_alive)
+    LLM_OPTIONS = parse_llm_options(opts.llm_options)
+    llm_model = "qwen2_5_coder_32b"
+    DATASET_ROOT = opts.dir
+
+    estimate = None
+    if opts.selection is not None:
+        ids = [x for x in read_selection(opts.selection) if selected_file(DATASET_ROOT, x) is not None]
+        score_of = complexity_scores(opts.metricfile) if opts.metricfile is not None else {}
+        if opts.progressive:
+            ids, strata = stratified_order(ids, score_of, opts.seed)
+            estimate = scoring.ProgressiveEstimate(strata, seed=opts.seed)
+        elif opts.metricfile is not None:
+            ids = order_by_complexity(ids, score_of)
+        files = [selected_file(DATASET_ROOT, x) for x in ids]
+        logger.info("Transpiling " + str(len(files)) + " selected functions of " + opts.selection)
+    else:
+        files = all_files(DATASET_ROOT)
+
+    # Identical (up to indentation and trailing whitespace) C functions are transpiled once, also across projects
+    transpile_cache = dedup.DedupCache("Transpilation")
+    # The selected functions of the projects are interleaved, so a log file is kept open per project
+    log_files = {}
+    previous_attempts = {}
+    print("Current model: " + str(MODEL))
+    progress = log.ProgressLogger(logger, "Transpilation", len(files), unit="functions", interval=0)
+    for index, (proj_name, file) in enumerate(files):
         INPUT_DIR = os.path.join(DATASET_ROOT, proj_name, "preprocessed_sf")
         OUT_DIR = os.path.join(DATASET_ROOT, proj_name, "rust_" + llm_model + "_sf_withfixing")
-        log_file = open(os.path.join(OUT_DIR, "transpilation.log"), "a")
-
-        print("Current model: " + str(MODEL))
-        for file in os.listdir(INPUT_DIR):
-            print("Processing: " + str(file))
-            if os.path.exists(os.path.join(OUT_DIR, os.path.splitext(file)[0] + '.rs')):
-                print("Already analyzed, Skipping!")
-                continue
-            with open(os.path.join(INPUT_DIR, file), "r") as fp:
-                try:
-                    input_C = fp.read()
-                except Exception as ex:
-                    print("Error in reading Input C file: " + str(traceback.format_exc()))
-                    log_file.write(str(file) + ": " + str(ex).replace("\n", " ") + "\n")
-                    continue
-            transpilation_res = None
-            compilation_res = None
-            number_of_compilation_iteration = 0
-            number_of_post_process_iter = 0
-            transpilation_time = 0
-            compilation_fixing_time = 0
-            post_process_fixing_time = 0
-            if input_C:
-                try:
-                    while True:
-                        transpilation_res = None
-                        compilation_res = None
-                        number_of_compilation_iteration = 0
-                        number_of_post_process_iter = 0
-                        transpilation_time = 0
-                        compilation_fixing_time = 0
-                        post_process_fixing_time = 0
-
-                        start_time = time.time()
-                        messages = []
-                        output_Rust, messages = transpilation(input_C)
-                        end_time = time.time()
-                        transpilation_time = round(end_time - start_time)
-                        if output_Rust == '':
-                            transpilation_res = False
-                        else:
-                            transpilation_res = True
-                            start_time = time.time()
-                            output_Rust, fix_count, res = check_and_fix_compilation(output_Rust, messages)
-                            end_time = time.time()
-                            compilation_fixing_time = round(end_time - start_time)
-                            number_of_compilation_iteration = fix_count
-                            if res:
-                                compilation_res = True
-                            else:
-                                compilation_res = False
-                                break
-
-                        if output_Rust == '':
-                            continue
-                        else:
-                            start_time = time.time()
-                            output_Rust, fix_count = check_pub_no_mangle(output_Rust)
-                            end_time = time.time()
-                            post_process_fixing_time = round(end_time - start_time)
-                            number_of_post_process_iter = fix_count
-                            break
-                except Exception as ex:
-                    print("Error in transpilation: " + str(traceback.format_exc()))
-                    log_file.write(str(file) + ": " + str(ex).replace("\n", " ") + "\n")
-                    continue
-            else:
-                print("Input file is empty!")
-                log_file.write(str(file) + ": " + "Input file is empty!" + "\n")
-                continue
-            
-            end_time = time.time()
-            with open(os.path.join(OUT_DIR, os.path.splitext(file)[0] + '.rs'), "w") as fp:
-                fp.write(output_Rust)
-
-            print(str(file) + ": " + "Successful transpilation!" + "\n")
-            log_file.write(str(file) + ";" + str(transpilation_res) + ";" + str(compilation_res) + ";"  +\
-                            str(transpilation_time) + ";" + str(number_of_compilation_iteration) + ";" +\
-                            str(compilation_fixing_time) + ";" + str(number_of_post_process_iter) + ";" +\
-                            str(post_process_fixing_time) + "\n")
-            log_file.flush()
+        if proj_name not in log_files:
+            if estimate is not None:
+                previous_attempts.update(logged_attempts(os.path.join(OUT_DIR, "transpilation.log")))
+            log_files[proj_name] = open(os.path.join(OUT_DIR, "transpilation.log"), "a")
+
+        log_fields = transpile_file(file, INPUT_DIR, OUT_DIR, log_files[proj_name], transpile_cache,
+                                     opts.llm_post_process, opts.candidates)
+        progress.update()
+        if estimate is None:
+            continue
+
+        # Functions that failed are left out of the estimate
+        attempts = log_fields.split(";")[3] if log_fields is not None else previous_attempts.get(file)
+        if attempts is None:
+            continue
+        estimate.add(index, scoring.attempt_code(attempts))
+        intervals = estimate.intervals()
+        logger.info("Estimate after " + str(estimate.num_done()) + " of " + str(len(files)) + " functions: histogram error " +
+                    format_interval(intervals["histogram"]) + ", relative difference score error " + format_interval(intervals["score"]))
+        if estimate.num_done() >= opts.min_functions and intervals[opts.stop_on][2] <= opts.tolerance:
+            logger.info("The " + opts.stop_on + " error is within " + str(opts.tolerance) + "%, stopping after " +
+                        str(index + 1) + " of " + str(len(files)) + " functions")
+            break
+
+    for log_file in log_files.values():
         log_file.close()
+    progress.done()
+    if estimate is not None:
+        logger.info("Estimated comp_attempt histogram: " + ", ".join(
+            (str(code) if code < scoring.NUM_OF_ATTEMPT_KEYS else ">" + str(scoring.NUM_OF_ATTEMPT_KEYS - 1)) + ": " +
+            str(round(share * 100, 1)) + "%" for code, share in enumerate(estimate.histogram()) if share > 0))
+    transpile_cache.report()
+    report_code_blocks()
+    report_prompt_evals()
+    tool_runner.report()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
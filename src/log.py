@@ -1,18 +1,17 @@
 import sys
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
+import profiler
 from colorlog import ColoredFormatter
 
-def init_log(level=logging.DEBUG):
-    logger = logging.getLogger()
-    logger.setLevel(level)
-    logging.getLogger().setLevel(level)
-    logging.getLogger('asyncio').setLevel(logging.WARNING)
-    logging.getLogger('cache').setLevel(logging.WARNING)
+def colored_handler(stream=sys.stdout):
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(logging.DEBUG)
 
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setLevel(logging.DEBUG)
-
-    stdout_handler.setFormatter(ColoredFormatter(
+    handler.setFormatter(ColoredFormatter(
         "%(log_color)s%(levelname)-8s%(reset)s | %(log_color)s%(asctime)-24s%(reset)s | %(log_color)s%(module)-13s%(reset)s | %(log_color)s%(message)s%(reset)s",
         log_colors={
             'DEBUG':    'green',
@@ -21,6 +20,84 @@ def init_log(level=logging.DEBUG):
             'ERROR':    'red',
             'CRITICAL': 'red,bg_white',
         }))
-    logger.addHandler(stdout_handler)
+    return handler
+
+def bulk_handler(stream=sys.stdout):
+    # Plain lines written by a background thread, the logging threads only
+    # put the records on a queue
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter("%(levelname)-8s | %(asctime)s | %(module)-13s | %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    handler = logging.handlers.QueueHandler(log_queue)
+    # Stopping the listener flushes the queue
+    handler.listener = listener
+    return handler
+
+def init_log(level=logging.DEBUG, bulk=False):
+    # bulk=True is meant for long runs over many files: plain format and a
+    # non-blocking handler, progress is reported through ProgressLogger
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logging.getLogger().setLevel(level)
+    logging.getLogger('asyncio').setLevel(logging.WARNING)
+    logging.getLogger('cache').setLevel(logging.WARNING)
+
+    logger.addHandler(bulk_handler() if bulk else colored_handler())
+
+    return logger
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return str(hours) + "h" + str(minutes).zfill(2) + "m"
+    if minutes:
+        return str(minutes) + "m" + str(seconds).zfill(2) + "s"
+    return str(seconds) + "s"
+
+class ProgressLogger:
+    # Aggregated progress line with throughput and ETA instead of a line per item,
+    # logged at most once every interval seconds
+    def __init__(self, logger, name, total=None, unit="files", interval=10.0):
+        self.logger = logger
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.count = 0
+        self.start = time.perf_counter()
+        self.last_log = self.start
+
+    def update(self, n=1):
+        self.count += n
+        now = time.perf_counter()
+        if now - self.last_log >= self.interval:
+            self.last_log = now
+            self.log(now)
+
+    def log(self, now):
+        elapsed = now - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        msg = self.name + ": " + str(self.count)
+        if self.total is not None:
+            msg += "/" + str(self.total)
+        msg += " " + self.unit + " (" + str(round(rate, 1)) + "/s"
+        if self.total is not None and rate > 0:
+            msg += ", ETA " + format_duration((self.total - self.count) / rate)
+        # Attribute the line to the caller of update(), not to this module
+        self.logger.info(msg + ")", stacklevel=3)
 
-    return logger
\ No newline at end of file
+    def done(self):
+        if profiler.enabled:
+            # The stage times are reported once, by the profile summary at the end of the run
+            self.logger.info(self.name + ": " + str(self.count) + " " + self.unit, stacklevel=2)
+            return
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        self.logger.info(self.name + ": " + str(self.count) + " " + self.unit + " in " +
+                         format_duration(elapsed) + " (" + str(round(rate, 1)) + "/s)", stacklevel=2)
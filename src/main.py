@@ -1,25 +1,34 @@
 import sys
 import os
-from IPython import embed
 from pathlib import Path
 import pandas
+import numpy as np
 import measure
+import tool_runner
+import profiler
+import metric_store
+import scoring
+import search
 from optparse import OptionParser
 
+import logging
 import log
-logger = log.init_log()
+logger = logging.getLogger(__name__)
 
 PROGRAM_USAGE = "Usage: \n"\
                 "%prog -m get -d [main_benchmark_dir] -c [csubdir] -r [rustsubdir]\n"\
                 "%prog -m select -o [output_path_for_selection]\n" \
-                "%prog -m tune -o [output_path_for_selection]\n"
+                "%prog -m tune -o [output_path_for_selection]\n" \
+                "%prog -m sweep -l [transpilation_log] -o [output_path_for_selection] [--redraws 1000] [--log_columns]\n" \
+                "%prog -m search -l [transpilation_log] -o [output_path_for_selection] [--max_selected 2000]\n" \
+                "%prog -m convert -f [metricfile]\n"
 
 def parse_args():
     """Parse and validate command line arguments."""
     parser = OptionParser(usage=PROGRAM_USAGE)
 
     parser.add_option('-m', '--mode', action='store', type='str',
-            default=None, help="The mode of operation. Options: get, tune, select")
+            default=None, help="The mode of operation. Options: get, tune, sweep, search, select, convert")
     
     parser.add_option('-d', '--dir', action='store', type='str',
             default=None, help="Main benchmark directory")
@@ -28,6 +37,11 @@ def parse_args():
     parser.add_option('-r', '--rustsubdir', action='store', type='str',
             default=None, help="Name of the subdirectory containing Rust files")
     
+    parser.add_option('-j', '--jobs', action='store', type='int',
+            default=None, help="Number of jobs for the Rust metric tools (default: all cores)")
+    parser.add_option('--append', action='store_true', default=False,
+            help="Append the collected metrics to an existing metric store and update the PCA ordering incrementally")
+
     parser.add_option('-f', '--metricfile', action='store', type='str',
             default=None, help="Name of the metric file to read/write collected metrics to/from")
     
@@ -36,10 +50,26 @@ def parse_args():
     parser.add_option('--ratio_of_sampling', action='store', type='float', 
             default=0.166, help="Hyperparameter specifying the ratio of sampling per bin")
 
+    parser.add_option('-l', '--transpilation_log', action='store', type='str',
+            default=None, help="Transpilation log to score the selections of the sweep or search against")
+    parser.add_option('--redraws', action='store', type='int',
+            default=0, help="Number of redrawn selections per combination of the sweep, from a random first row of every cell (default: none)")
+    parser.add_option('--log_columns', action='store_true', default=False,
+            help="Also score the sweep selections on every numeric log column (relative diff, KS and Wasserstein)")
+    parser.add_option('--max_selected', action='store', type='int',
+            default=None, help="Maximum number of selected functions of the search (default: no limit)")
+
     parser.add_option('-o', '--out', action="store", type="str", 
             default="out/metrics#4_fullset_v1/selected_func_lists/",
             help="Specify the output path for selections")
 
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+            help="Log at DEBUG level")
+    parser.add_option('--profile', action='store', type='str', default=None,
+            help="Time the stages, projects and external tools and write the summary to PROFILE.json and PROFILE.csv")
+    parser.add_option('--trace', action='store_true', default=False,
+            help="With --profile, also write a Chrome trace to PROFILE.trace.json")
+
     opts, args = parser.parse_args()
 
     # Input validation
@@ -60,19 +90,41 @@ def parse_args():
                 parser.print_help()
                 print("Output path must be specified for selection or parameter tuning", file=sys.stderr)
                 sys.exit(1)
+        elif opts.mode == "sweep" or opts.mode == "search":
+            if opts.out is None or opts.transpilation_log is None:
+                parser.print_help()
+                print("Output path and transpilation log must be specified for the sweep or search", file=sys.stderr)
+                sys.exit(1)
+        elif opts.mode == "convert":
+            if opts.metricfile is None:
+                parser.print_help()
+                print("Metric file must be specified for conversion", file=sys.stderr)
+                sys.exit(1)
         else:
             parser.print_help()
-            print("The mode sohuld be set to one of these: get, tune, select", file=sys.stderr)
+            print("The mode sohuld be set to one of these: get, tune, sweep, search, select, convert", file=sys.stderr)
             sys.exit(1)    
 
+    if opts.trace and opts.profile is None:
+        parser.print_help()
+        print("--trace requires --profile", file=sys.stderr)
+        sys.exit(1)
+
     return (opts, args)
 
-def get_metrics(projects_root_dir, c_sub_dir, rust_dir, metricfile):
+def get_metrics(projects_root_dir, c_sub_dir, rust_dir, metricfile, append=False, num_jobs=None):
     projects_root_dir = Path(projects_root_dir)
     proj_dirs = [x for x in projects_root_dir.iterdir() if x.is_dir()]
 
-    all_projs_merged = pandas.DataFrame()
+    # The metrics of each project are appended to the store and the csv as soon
+    # as they are collected, so only a single project is held in memory
+    if append:
+        csv_header = not os.path.exists(metricfile + ".csv")
+    else:
+        metric_store.remove_store(metricfile)
+        csv_header = True
     
+    progress = log.ProgressLogger(logger, "Projects", len(proj_dirs), unit="projects", interval=0)
     for proj_dir in proj_dirs:
         proj_dir = str(proj_dir)
         logger.info("Processing: " + str(proj_dir))
@@ -88,52 +140,229 @@ def get_metrics(projects_root_dir, c_sub_dir, rust_dir, metricfile):
         
         rust_dirs_proj = (transpiler_name, os.path.join(proj_dir, dir))
 
-        metrics_dict, metrics_sum_dict, merged_df = \
-            measure.get_metrics(c_dir_fpath, rust_dirs_proj)
-        all_projs_merged = pandas.concat([all_projs_merged, merged_df])
-    
-    all_projs_merged.to_pickle(metricfile + '.pkl')
-    all_projs_merged.to_csv(metricfile + ".csv", sep=";", index=False)
+        with profiler.span("project", os.path.basename(proj_dir)):
+            merged_df = measure.get_metrics(c_dir_fpath, rust_dirs_proj, num_jobs)
+        profiler.count("projects")
+        profiler.count("functions", len(merged_df))
+        progress.update()
+        if merged_df.empty:
+            continue
 
+        with profiler.span("stage", "store"):
+            metric_store.append_metrics(merged_df, metricfile)
+            merged_df.to_csv(metricfile + ".csv", sep=";", index=False,
+                             mode="w" if csv_header else "a", header=csv_header)
+        csv_header = False
 
-def select_funcs(outpath, num_of_partition, ratio_of_sampling, metricfile):
+        if append and all(x in merged_df.columns for x in chosen_metrics):
+            with profiler.span("stage", "PCA update"):
+                measure.update_summary_complexity(metricfile, chosen_metrics)
 
-    all_projs_merged = pandas.read_pickle(metricfile + ".pkl")
+    progress.done()
+    measure.report_dedup()
+    tool_runner.report()
 
-    chosen_metrics = [
-                    'MI_C',
-                    'qwen2_5_coder_32b_MI_R',
-                    'qwen2_5_coder_32b_avg_unsafe_stmt_R',
-                    'qwen2_5_coder_32b_total_uniq_type_R'
-                    ]
 
-    # Partition and select from bins 
-    logger.info("Number of partitions: " + str(num_of_partition))
-    logger.info("Ratio of sampling per bin: " + str(ratio_of_sampling))
-    bins = measure.partition(all_projs_merged, chosen_metrics, num_of_partition)
-    logger.info("Number of bins: " + str(len(bins)))
-    selected_funcs_df = measure.select_from_bins(bins, ratio_of_sampling)
+chosen_metrics = [
+                'MI_C',
+                'qwen2_5_coder_32b_MI_R',
+                'qwen2_5_coder_32b_avg_unsafe_stmt_R',
+                'qwen2_5_coder_32b_total_uniq_type_R'
+                ]
 
-    # Save the selected list of functions
-    selected_funcs_ls = list(selected_funcs_df["id"])
-    out_filename = "selected_funcs#" + str(num_of_partition) + "#" + str(ratio_of_sampling).replace(".", "_") + "#" + str(len(bins)) + ".txt"
+def write_selection(outpath, num_of_partition, ratio_of_sampling, num_of_bins, selected_funcs_ls):
+    out_filename = "selected_funcs#" + str(num_of_partition) + "#" + str(ratio_of_sampling).replace(".", "_") + "#" + str(num_of_bins) + ".txt"
     out = os.path.join(outpath, out_filename) 
     with open(out, "w") as f:
         for s in selected_funcs_ls:
             f.write(s + "\n")
 
+def select_funcs(outpath, num_of_partition, ratios_of_sampling, metricfile):
+
+    with profiler.span("stage", "load"):
+        all_projs_merged = metric_store.load_metrics(metricfile, chosen_metrics)
+
+    # Partition once and select from the bins for every ratio of sampling at once
+    logger.info("Number of partitions: " + str(num_of_partition))
+    with profiler.span("stage", "summary complexity"):
+        scores = measure.get_summary_complexity(all_projs_merged, chosen_metrics, metricfile)
+    with profiler.span("stage", "partition"):
+        df_cells, starts = measure.partition_cells(all_projs_merged, chosen_metrics, num_of_partition, scores)
+    logger.info("Number of bins: " + str(len(starts)))
+    with profiler.span("stage", "select"):
+        selections = measure.select_from_cells(starts, len(df_cells), ratios_of_sampling)
+
+    # Save the selected list of functions
+    ids = df_cells["id"].to_numpy()
+    with profiler.span("stage", "write selections"):
+        for ratio_of_sampling, positions in zip(ratios_of_sampling, selections):
+            logger.debug("Ratio of sampling per bin: " + str(ratio_of_sampling))
+            write_selection(outpath, num_of_partition, ratio_of_sampling, len(starts), ids[positions])
+    profiler.count("selections", len(ratios_of_sampling))
+
+def sweep_funcs(outpath, transpilation_log_file, metricfile, partitions, ratios_of_sampling, num_draws=0, log_columns=False):
+    # Partitions, selects and scores every combination of the tune mode in memory,
+    # then writes the ranked scores and only the best selection. With num_draws,
+    # num_draws selections of every combination are redrawn from a random first
+    # row of every cell and the spread of their scores is written as well. With log_columns, every numeric log column is scored as well
+    # (the ranking stays by comp_attempt).
+
+    with profiler.span("stage", "load"):
+        all_projs_merged = metric_store.load_metrics(metricfile, chosen_metrics)
+        transpilation_log_dict = scoring.load_transpilation_log(transpilation_log_file, all_projs_merged["id"])
+    logger.info("Transpilation log entries: " + str(len(transpilation_log_dict)) + " of " + str(len(all_projs_merged)) + " functions")
+
+    with profiler.span("stage", "summary complexity"):
+        scores = measure.get_summary_complexity(all_projs_merged, chosen_metrics, metricfile)
+
+    results = []
+    extra_columns = []
+    if log_columns:
+        # The log values are parsed once, in the row order of the metrics
+        values = scoring.log_column_values(transpilation_log_dict, all_projs_merged["id"])
+        row_of = pandas.Index(all_projs_merged["id"])
+        extra_columns = [name + "_" + score for field, name, kind in scoring.LOG_COLUMNS
+                         for score in ["relative_diff", "ks", "wasserstein"]]
+    redrawn = []
+    rng = np.random.default_rng(0)
+    best_diff, best_ids = None, None
+    progress = log.ProgressLogger(logger, "Sweep", len(partitions), unit="partitionings")
+    for num_of_partition in partitions:
+        with profiler.span("stage", "partition"):
+            df_cells, starts = measure.partition_cells(all_projs_merged, chosen_metrics, num_of_partition, scores)
+        with profiler.span("stage", "select"):
+            selections = measure.select_from_cells(starts, len(df_cells), ratios_of_sampling)
+        with profiler.span("stage", "score"):
+            # The rows are in cell order, which depends on the number of partitions
+            scorer = scoring.SelectionScorer(scoring.comp_attempt_codes(transpilation_log_dict, df_cells["id"]))
+            if log_columns:
+                column_scorer = scoring.DistributionScorer(values[row_of.get_indexer(df_cells["id"])])
+            for ratio_of_sampling, positions in zip(ratios_of_sampling, selections):
+                diff = scorer.score(positions)
+                # Only the ids of the best selection so far are kept
+                if best_diff is None or diff < best_diff:
+                    best_diff, best_ids = diff, df_cells["id"].to_numpy()[positions]
+                result = (diff, num_of_partition, ratio_of_sampling, len(starts), len(positions))
+                if log_columns:
+                    result += sum(column_scorer.score(positions).values(), ())
+                results.append(result)
+        if num_draws:
+            with profiler.span("stage", "redraw"):
+                interval = measure.cell_sample_counts(starts, len(df_cells), ratios_of_sampling)[1]
+                redrawn.append(scoring.redraw_scores(scorer.codes, starts, interval, num_draws, rng))
+        profiler.count("selections", len(ratios_of_sampling))
+        progress.update()
+    progress.done()
+
+    if num_draws:
+        with profiler.span("stage", "redraw"):
+            quantiles = scoring.redraw_quantiles([x[0] for x in results], np.concatenate(redrawn))
+        results = [result + tuple(x[i] for x in quantiles) for i, result in enumerate(results)]
+        extra_columns += ["redraw_p2.5", "redraw_median", "redraw_p97.5", "redraw_percentile"]
+
+    # Ties keep the order of the sweep, i.e. fewer partitions and smaller ratios first
+    results.sort(key=lambda x: x[0])
+
+    if num_draws:
+        # The combination whose selections score best on the whole, which need not
+        # be the one of the best selection
+        median = 5 + extra_columns.index("redraw_median")
+        steady = min(results, key=lambda x: x[median])
+        logger.info("Lowest median of the redrawn selections: " + str(steady[1]) + " partitions, ratio " + str(steady[2]) +
+                    ", median " + str(round(steady[median], 2)) + "%; the best selection scores at percentile " +
+                    str(round(results[0][median + 2], 1)) + " of its redraws")
+
+    write_scores(outpath, "sweep_scores.csv", results, best_ids, extra_columns)
+
+def write_scores(outpath, filename, results, best_ids, extra_columns=[]):
+    # results are ranked (relative_diff, num_of_partition, ratio_of_sampling, num_of_bins, num_selected),
+    # followed by the values of extra_columns, e.g. the redraw percentiles of relative_diff
+    with profiler.span("stage", "write selections"):
+        with open(os.path.join(outpath, filename), "w") as f:
+            header = ["rank", "num_of_partition", "ratio_of_sampling", "num_of_bins", "num_selected", "relative_diff"]
+            f.write(";".join(header + extra_columns) + "\n")
+            for rank, result in enumerate(results, 1):
+                f.write(";".join(str(x) for x in (rank,) + result[1:5] + result[:1] + result[5:]) + "\n")
+
+        diff, num_of_partition, ratio_of_sampling, num_of_bins, num_selected = results[0][:5]
+        write_selection(outpath, num_of_partition, ratio_of_sampling, num_of_bins, best_ids)
+
+    for rank, result in enumerate(results[:5], 1):
+        diff, num_of_partition, ratio_of_sampling, num_of_bins, num_selected = result[:5]
+        redraws = ""
+        if "redraw_median" in extra_columns:
+            p2_5, median, p97_5, percentile = (result[5 + extra_columns.index(x)] for x in
+                                               ["redraw_p2.5", "redraw_median", "redraw_p97.5", "redraw_percentile"])
+            redraws = " (redraws " + str(round(p2_5, 2)) + "-" + str(round(p97_5, 2)) + "%, median " + str(round(median, 2)) + \
+                "%, percentile " + str(round(percentile, 1)) + ")"
+        logger.info("#" + str(rank) + ": " + str(num_of_partition) + " partitions, ratio " + str(ratio_of_sampling) +
+                    ", " + str(num_selected) + " functions, relative diff " + str(round(diff, 2)) + "%" + redraws)
+
+def search_funcs(outpath, transpilation_log_file, metricfile, partitions, ratios_of_sampling, max_selected):
+    # Adaptive version of the sweep, which only scores part of the grid to find the
+    # best selection of at most max_selected functions
+
+    with profiler.span("stage", "load"):
+        all_projs_merged = metric_store.load_metrics(metricfile, chosen_metrics)
+        transpilation_log_dict = scoring.load_transpilation_log(transpilation_log_file, all_projs_merged["id"])
+    logger.info("Transpilation log entries: " + str(len(transpilation_log_dict)) + " of " + str(len(all_projs_merged)) + " functions")
+
+    with profiler.span("stage", "summary complexity"):
+        scores = measure.get_summary_complexity(all_projs_merged, chosen_metrics, metricfile)
+
+    evaluator = search.SweepEvaluator(all_projs_merged, chosen_metrics, scores, transpilation_log_dict, ratios_of_sampling)
+    best = search.successive_halving(evaluator, partitions, max_selected)
+    if best is None:
+        logger.error("No selection has at most " + str(max_selected) + " functions")
+        sys.exit(1)
+
+    num_grid = len(partitions) * len(ratios_of_sampling)
+    logger.info("Scored " + str(evaluator.num_evaluations) + " selections instead of " + str(num_grid) +
+                " (" + str(round(100 * (1 - evaluator.num_evaluations / num_grid), 1)) + "% saved), partitioned " +
+                str(len(evaluator.partitionings)) + " times")
+
+    diff, num_of_partition, index = best
+    write_scores(outpath, "search_scores.csv", evaluator.ranked(), evaluator.selection(num_of_partition, index))
+
+# The grid of the hyperparameters searched by the tune and sweep modes
+tune_partitions = list(range(1, 21))
+tune_ratios = [round(x * 0.002, 3) for x in range(1, 101)]
+
+# Log level and whether the bulk (queued, plain, progress-only) logging is used per mode
+mode_logging = {
+    "get": (logging.INFO, True),
+    "tune": (logging.INFO, True),
+    "sweep": (logging.INFO, True),
+    "search": (logging.INFO, False),
+    "select": (logging.INFO, False),
+    "convert": (logging.INFO, False),
+}
+
 def main():
 
     opts, args = parse_args()
+    level, bulk = mode_logging[opts.mode]
+    log.init_log(logging.DEBUG if opts.verbose else level, bulk)
+    if opts.profile is not None:
+        profiler.enable(opts.trace)
 
     if opts.mode == "get":
-        get_metrics(opts.dir, opts.csubdir, opts.rustsubdir, opts.metricfile)
+        get_metrics(opts.dir, opts.csubdir, opts.rustsubdir, opts.metricfile, opts.append, opts.jobs)
     elif opts.mode == "select":
-        select_funcs(opts.out, opts.num_of_partition, opts.ratio_of_sampling, opts.metricfile)
+        select_funcs(opts.out, opts.num_of_partition, [opts.ratio_of_sampling], opts.metricfile)
     elif opts.mode == "tune":
-        for num_of_partition in range(1,21):
-            for ratio_of_sampling in [round(x * 0.002, 3) for x in range(1, 101)]:
-                select_funcs(opts.out, num_of_partition, ratio_of_sampling, opts.metricfile)
+        for num_of_partition in tune_partitions:
+            select_funcs(opts.out, num_of_partition, tune_ratios, opts.metricfile)
+    elif opts.mode == "sweep":
+        sweep_funcs(opts.out, opts.transpilation_log, opts.metricfile, tune_partitions, tune_ratios, opts.redraws, opts.log_columns)
+    elif opts.mode == "search":
+        search_funcs(opts.out, opts.transpilation_log, opts.metricfile, tune_partitions, tune_ratios, opts.max_selected)
+    elif opts.mode == "convert":
+        metric_store.convert_pickle(opts.metricfile)
+        logger.info("Converted " + opts.metricfile + ".pkl into " + metric_store.store_path(opts.metricfile))
+
+    if opts.profile is not None:
+        profiler.write_profile(opts.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,25 +1,47 @@
 import sys
 import os
-import subprocess
+import tempfile
+import functools
+import shutil
+import time
 from pathlib import Path
-from IPython import embed
 import csv
 import json
 from io import StringIO
 import numpy as np
 import pandas
+import metric_store
+import dedup
+import tool_runner
+import profiler
+import log
 
 import logging
-from colorlog import ColoredFormatter
-
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
 
 logger = logging.getLogger(__name__)
 
-p = subprocess.Popen(['docker', 'ps', '-qf', 'ancestor=ccccc-docker:latest'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-out, err = p.communicate()
-container_id = out.decode().strip("\n")
+# The Rust metric tools are used as optimized release builds (see README):
+# rust-code-analysis runs once per project, the others once per unique source. The
+# paths can be overridden from the environment.
+RUST_CODE_ANALYSIS_BIN = os.environ.get("RUST_CODE_ANALYSIS_BIN", "src/rust-code-analysis/target/release/rust-code-analysis-cli")
+DUMP_UNSAFE_USAGE_BIN = os.environ.get("DUMP_UNSAFE_USAGE_BIN", "src/bin/dump-unsafe-usage")
+DUMP_VAR_TYPES_BIN = os.environ.get("DUMP_VAR_TYPES_BIN", "src/bin/dump-var-types")
+
+# Results of the metric tools per unique (indentation-normalized) source file
+MI_C_cache = dedup.DedupCache("C MI")
+MI_Rust_cache = dedup.DedupCache("Rust MI")
+unsafe_measure_cache = dedup.DedupCache("Rust unsafe")
+var_type_measure_cache = dedup.DedupCache("Rust variable-type")
+
+def report_dedup():
+    for cache in [MI_C_cache, MI_Rust_cache, unsafe_measure_cache, var_type_measure_cache]:
+        cache.report()
+
+@functools.lru_cache(maxsize=None)
+def get_container_id():
+    # The ccccc container is only looked up once, when C metrics are first collected
+    returncode, out, err = tool_runner.run_tool("docker", ['docker', 'ps', '-qf', 'ancestor=ccccc-docker:latest'])
+    return out.decode().strip("\n")
 
 def get_comp_attempt_measure(rust_file_dir, proj_name, transpiler_name):
 
@@ -27,6 +49,7 @@ def get_comp_attempt_measure(rust_file_dir, proj_name, transpiler_name):
     transpilation_log_file = os.path.join(rust_file_dir, "transpilation.log")
     if not os.path.exists(transpilation_log_file):
         logger.error("tranpilation log file not found!")
+        from IPython import embed
         embed()
         sys.exit(1)
 
@@ -58,80 +81,137 @@ def get_comp_attempt_measure(rust_file_dir, proj_name, transpiler_name):
     comp_attemp_df = pandas.DataFrame(comp_attemp_ls, columns = columns)
     return comp_attempt_dict, comp_attemp_df
 
+def iter_MI_for_C(c_file_dir, proj_name):
+    # Yields one row of C metrics per function without keeping the tool output.
+    # Duplicate sources are analyzed once and their metrics reused.
+    c_filenames = [x for x in os.listdir(c_file_dir) if x.endswith(".c")]
+    progress = log.ProgressLogger(logger, "C MI " + proj_name, len(c_filenames))
+    for c_filename in c_filenames:
+        c_file = os.path.join(c_file_dir, c_filename)
+        progress.update()
+
+        digest = dedup.source_digest(c_file)
+        metrics_ls = MI_C_cache.lookup(digest)
+        if metrics_ls is None:
+            start_time = time.time()
+            container_id = get_container_id()
+            docker_file_path = os.path.join("/tmp", os.path.basename(c_file))
+            cmd1 = ['docker', 'cp', c_file, container_id + ":" + docker_file_path]
+            
+            # ccccc tool is from https://github.com/Jarod42/ccccc
+            # Killing the docker client does not stop ccccc in the container, so
+            # the budget is also enforced inside of it
+            ccccc_timeout = tool_runner.get_timeout("ccccc")
+            cmd2 = ['docker', 'exec', '-i', container_id, 'bash', '-c', 'timeout -s KILL ' + str(ccccc_timeout) + ' ccccc --extra-option=-ferror-limit=0 --template-file=/opt/html_static/template/csv/template.csv ' + docker_file_path + ' 2>/dev/null ' + '; rm ' + docker_file_path]
+            try:
+                tool_runner.run_tool("docker", cmd1, item=c_file)
+                returncode, out, err = tool_runner.run_tool("ccccc", cmd2, item=c_file,
+                    timeout=ccccc_timeout + tool_runner.get_timeout("docker"))
+                reader = csv.reader(StringIO(out.decode()), delimiter=";")
+                metrics_ls = [[float(line[5]), float(line[9]), float(line[13]), float(line[20])] \
+                    for line in reader if line[0] != "Filename"]
+            except tool_runner.ToolTimeout as ex:
+                logger.warning("No C metrics for " + c_file + ": " + str(ex))
+                metrics_ls = []
+            MI_C_cache.put(digest, metrics_ls, time.time() - start_time)
+        MI_C_cache.count(digest)
+
+        file_func_name = Path(c_filename).stem
+        # funcname = line[4].split("(")[0]
+        elems = file_func_name.split("#")
+        if len(elems) == 2:
+            filename, funcname = file_func_name.split("#")
+        elif len(elems) == 3:
+            proj_name = elems[0]
+            filename = elems[1]
+            funcname = elems[2]
+        else:
+            logger.error("File name format is not recognized")
+            from IPython import embed
+            embed()
+        for metrics in metrics_ls:
+            yield [str(proj_name + ":" + filename + ":" + funcname)] + metrics
+    progress.done()
+
 def get_MI_for_C(c_file_dir, proj_name):
 
     logger.info("Collecting MI metrics for C functions")
-    MI_C_dict = {}
-    MI_C_ls = []
     columns = ["id", "LOCphy_C", "MVG_C", "Volume_C", "MI_C"]
-    tmp_count = 0
-    for c_filename in os.listdir(c_file_dir):
-        if not c_filename.endswith(".c"):
-            continue
-        c_file = os.path.join(c_file_dir, c_filename)
-
-        logger.debug("Processing: " + str(c_file))
-        docker_file_path = os.path.join("/tmp", os.path.basename(c_file))
-        cmd1 = ['docker', 'cp', c_file, container_id + ":" + docker_file_path]
-        p = subprocess.Popen(cmd1, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-        out, err = p.communicate()
-        
-        # ccccc tool is from https://github.com/Jarod42/ccccc
-        cmd2 = ['docker', 'exec', '-i', container_id, 'bash', '-c', 'ccccc --extra-option=-ferror-limit=0 --template-file=/opt/html_static/template/csv/template.csv ' + docker_file_path + ' 2>/dev/null ' + '; rm ' + docker_file_path]
-        p = subprocess.Popen(cmd2, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-        out, err = p.communicate()
-
-        reader = csv.reader(StringIO(out.decode()), delimiter=";")
-
-        for line in reader:
-            if line[0] == "Filename":
-                tmp = line
+    MI_C_df = pandas.DataFrame(iter_MI_for_C(c_file_dir, proj_name), columns = columns)
+    return MI_C_df
+
+def rust_analysis_output_dir(out_dir, rust_file_dir):
+    # rust-code-analysis-cli mirrors the input path under the output directory,
+    # without the root and with '..' replaced by '.'
+    parts = [x if x != ".." else "." for x in Path(rust_file_dir).parts if x != os.sep]
+    return os.path.join(out_dir, *parts)
+
+def stage_file(src, dst):
+    # Hard link the file if possible, copy it otherwise
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def iter_MI_for_Rust(rust_file_dir, proj_name, num_jobs=None):
+    # Yields one row of Rust MI metrics per function without keeping the JSON output.
+    # The unique sources are staged into a directory that is analyzed by a single
+    # multi-threaded run of the tool, which writes one JSON file per Rust file.
+    # rust-code-analysis tool is from https://www.sciencedirect.com/science/article/pii/S2352711020303484
+    bin = RUST_CODE_ANALYSIS_BIN
+    rust_files = []
+    with tempfile.TemporaryDirectory() as stage_dir, tempfile.TemporaryDirectory() as out_dir:
+        staged = {}
+        for rust_filename in os.listdir(rust_file_dir):
+            if not rust_filename.endswith(".rs"):
                 continue
-
-            garb, file_func_name = line[0].split("/")
-            file_func_name = Path(file_func_name).stem
-            # funcname = line[4].split("(")[0]
-            elems = file_func_name.split("#")
-            tmp_count += 1
-            if len(elems) == 2:
-                filename, funcname = file_func_name.split("#")
-            elif len(elems) == 3:
-                proj_name = elems[0]
-                filename = elems[1]
-                funcname = elems[2]
-            else:
-                logger.error("File name format is not recognized")
-                embed()
-            MI_C_dict[proj_name + ":" + filename + ":" + funcname] = line
-            MI_C_ls.append([str(proj_name + ":" + filename + ":" + funcname), float(line[5]), float(line[9]), \
-                float(line[13]), float(line[20])])
-    MI_C_df = pandas.DataFrame(MI_C_ls, columns = columns)
-    return MI_C_dict, MI_C_df
-
-def get_MI_for_Rust(rust_file_dir, proj_name, transpiler_name):
-    logger.info("Collecting MI metrics for Rust functions")
-
-    MI_Rust_dict = {}
-    MI_C_ls = []
-    columns = ["id", "SLOC_R", "Cyclomatic_R", "Volume_R", "MI_R"]
-    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
-
-    for rust_filename in os.listdir(rust_file_dir):
-        
-        if not rust_filename.endswith(".rs"):
-            continue
-        rust_file = os.path.join(rust_file_dir, rust_filename)
-
-        logger.debug("Processing: " + str(rust_file))
-        # rust-code-analysis tool is from https://www.sciencedirect.com/science/article/pii/S2352711020303484
-        bin = "src/rust-code-analysis/target/debug/rust-code-analysis-cli"
-        cmd = [bin, '-m', '-O', 'json', '-p', rust_file]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-        out, err = p.communicate()
-        if out == b'':
-            continue
-
-        basename = Path(os.path.basename(rust_file)).stem
+            rust_file = os.path.join(rust_file_dir, rust_filename)
+            digest = dedup.source_digest(rust_file)
+            rust_files.append((rust_filename, digest))
+            if MI_Rust_cache.lookup(digest) is None and digest not in staged:
+                staged[digest] = rust_filename
+                stage_file(rust_file, os.path.join(stage_dir, rust_filename))
+
+        if staged:
+            logger.debug("Processing: " + str(rust_file_dir))
+            start_time = time.time()
+            cmd = [bin, '-m', '-O', 'json', '-I', '*.rs', '-p', stage_dir, '-o', out_dir]
+            if num_jobs is not None:
+                cmd += ['-j', str(num_jobs)]
+            json_dir = rust_analysis_output_dir(out_dir, stage_dir)
+            try:
+                tool_runner.run_tool("rust-code-analysis-batch", cmd, item=rust_file_dir)
+            except tool_runner.ToolTimeout:
+                # Find the pathological files by analyzing the remaining ones one by one
+                for rust_filename in staged.values():
+                    if os.path.exists(os.path.join(json_dir, rust_filename + ".json")):
+                        continue
+                    rust_file = os.path.join(stage_dir, rust_filename)
+                    cmd = [bin, '-m', '-O', 'json', '-p', rust_file, '-o', out_dir]
+                    try:
+                        tool_runner.run_tool("rust-code-analysis", cmd, item=os.path.join(rust_file_dir, rust_filename))
+                    except tool_runner.ToolTimeout as ex:
+                        logger.warning("No Rust MI metrics: " + str(ex))
+            elapsed = (time.time() - start_time) / len(staged)
+
+            for digest, rust_filename in staged.items():
+                json_file = os.path.join(json_dir, rust_filename + ".json")
+                spaces = []
+                if os.path.exists(json_file):
+                    with open(json_file, "r") as fp:
+                        json_out = json.load(fp)
+                    if json_out["spaces"]:
+                        spaces = [(func["name"], [float(func["metrics"]["loc"]["sloc"]), \
+                            float(func["metrics"]["cyclomatic"]["sum"]),\
+                            float(func["metrics"]["halstead"]["volume"]),\
+                            float(func["metrics"]["mi"]["mi_original"])]) for func in json_out["spaces"]]
+                    else:
+                        logger.warning("Rust MI metrics are empty for " + os.path.join(rust_file_dir, rust_filename))
+                MI_Rust_cache.put(digest, spaces, elapsed)
+
+    for rust_filename, digest in rust_files:
+        MI_Rust_cache.count(digest)
+        basename = Path(rust_filename).stem
         elems = basename.split("#")
         if len(elems) == 2:
             filename = elems[0]
@@ -143,46 +223,43 @@ def get_MI_for_Rust(rust_file_dir, proj_name, transpiler_name):
         else:
             logger.warning("File name format is not recognized")
 
-        json_out = json.loads(out.decode())
-
-        if json_out["spaces"]:
-            for func in json_out["spaces"]:
-                funcname = func["name"]
-                if funcname != target_func_name:
-                    continue
-
-                MI_Rust_dict[proj_name + ":" + filename + ":" + funcname] = json_out
-                MI_C_ls.append([str(proj_name + ":" + filename + ":" + funcname), \
-                    float(func["metrics"]["loc"]["sloc"]), \
-                    float(func["metrics"]["cyclomatic"]["sum"]),\
-                    float(func["metrics"]["halstead"]["volume"]),\
-                    float(func["metrics"]["mi"]["mi_original"])])
-        else:
-            logger.warning("Rust MI metrics are empty for " + json_out["name"])
+        for funcname, metrics in MI_Rust_cache.lookup(digest):
+            if funcname != target_func_name:
+                continue
+            yield [str(proj_name + ":" + filename + ":" + funcname)] + metrics
 
-    MI_Rust_df = pandas.DataFrame(MI_C_ls, columns = columns)
-    return MI_Rust_dict, MI_Rust_df
+def get_MI_for_Rust(rust_file_dir, proj_name, transpiler_name, num_jobs=None):
+    logger.info("Collecting MI metrics for Rust functions")
 
-def get_unsafe_measure(rust_file_dir, proj_name, transpiler_name):
-    bin = "src/bin/dump-unsafe-usage"
+    columns = ["id", "SLOC_R", "Cyclomatic_R", "Volume_R", "MI_R"]
+    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
 
-    logger.info("Collecting unsafe metrics for Rust functions")
+    MI_Rust_df = pandas.DataFrame(iter_MI_for_Rust(rust_file_dir, proj_name, num_jobs), columns = columns)
+    return MI_Rust_df
 
-    unsafe_measure_dict = {}
-    unsafe_measure_ls = []
-    columns = ["id", "total_unsafe_block_R", "avg_unsafe_stmt_R"]
-    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
+def iter_unsafe_measure(rust_file_dir, proj_name):
+    # Yields one row of unsafe metrics per function, the tool runs once per unique source
+    bin = DUMP_UNSAFE_USAGE_BIN
 
-    for rust_filename in os.listdir(rust_file_dir):
-        if not rust_filename.endswith(".rs"):
-            continue
+    rust_filenames = [x for x in os.listdir(rust_file_dir) if x.endswith(".rs")]
+    progress = log.ProgressLogger(logger, "Rust unsafe " + proj_name, len(rust_filenames))
+    for rust_filename in rust_filenames:
         rust_file = os.path.join(rust_file_dir, rust_filename)
-
-        logger.debug("Processing: " + str(rust_file))
-        cmd = [bin, rust_file]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        reader = csv.reader(StringIO(out.decode()), delimiter=";")
+        progress.update()
+
+        digest = dedup.source_digest(rust_file)
+        lines = unsafe_measure_cache.lookup(digest)
+        if lines is None:
+            start_time = time.time()
+            cmd = [bin, rust_file]
+            try:
+                returncode, out, err = tool_runner.run_tool("dump-unsafe-usage", cmd, item=rust_file)
+                lines = list(csv.reader(StringIO(out.decode()), delimiter=";"))
+            except tool_runner.ToolTimeout as ex:
+                logger.warning(str(ex))
+                lines = []
+            unsafe_measure_cache.put(digest, lines, time.time() - start_time)
+        unsafe_measure_cache.count(digest)
 
         basename = Path(os.path.basename(rust_file)).stem
         elems = basename.split("#")
@@ -196,11 +273,10 @@ def get_unsafe_measure(rust_file_dir, proj_name, transpiler_name):
         else:
             logger.warning("File name format is not recognized")
 
-        for line in reader:
+        for line in lines:
             funcname = line[0]
             if target_func_name != funcname:
                 continue
-            unsafe_measure_dict[proj_name + ":" + filename + ":" + funcname] = line
             total_unsafe_block = int(line[1])
             if total_unsafe_block > 0:
                 sum = 0
@@ -210,77 +286,90 @@ def get_unsafe_measure(rust_file_dir, proj_name, transpiler_name):
             else:
                 avg = 0
             
-            unsafe_measure_ls.append([str(proj_name + ":" + filename + ":" + funcname), \
-                int(total_unsafe_block), float(avg)])
+            yield [str(proj_name + ":" + filename + ":" + funcname), \
+                int(total_unsafe_block), float(avg)]
+    progress.done()
 
-    unsafe_measure_df = pandas.DataFrame(unsafe_measure_ls, columns = columns)
-    return unsafe_measure_dict, unsafe_measure_df
-
-def get_type_cat(line):
-    cat = ""
-    if "NotIdentified#" in line[2]:
-        return None
-    
-    if "*" == line[2][:1] or "&" == line[2][:1] \
-        or line[2] == "libc::c_void" or line[2] == "libc :: c_void":
-        cat = "pointer"
-    elif line[2] == "i64" or line[2] == "i32" \
-            or line[2] == "u64" or line[2] == "u32" \
-            or line[2] == "c_uint" or line[2] == "c_int" or line[2] == "libc :: c_int" \
-            or line[2][-7:] == "c_ulong" or line[2][-6:] == "c_long" \
-            or line[2] == "libc :: size_t" or line[2] == "size_t" or line[2] == "c_size_t"\
-            or line[2] == "usize" or line[2] == "isize" \
-            or line[2] == "u8" or line[2] == "i8" \
-            or line[2] == "i128" or line[2] == "u_int" or line[2] == "int":
-        cat = "integer"
-    elif line[2] == "f64" or line[2] == "f32" or line[2] == "float" \
-            or line[2] == "c_double":
-        cat = "float"
-    elif line[2] == "string":
-        cat = "string"
-    elif line[2] == "char" or line[2] == "c_char" or line[2] == "libc :: c_char":
-        cat = "char"
-    elif line[2] == "bool":
-        cat = "bool"
-    elif line[2][:4] == "enum":
-        cat = "enum"
-    elif line[2][:5] == "array":
-        cat = "array"
-    elif line[2][:5] == "tuple":
-        cat = "tuple"
-    elif line[2][:6] == "struct" \
-        or line[2] == "libc::timespec" or line[2] == "libc::timespec":
-        cat = "struct"
-    elif line[2] == "Vec<u8>" or line[2] == "Vec < u8 >":
-        cat = "vector"
-    elif line[2][:7] == "HashMap":
-        cat = "hashmap"
-    elif line[2][:6] == "Option":
-        cat = "option"
-    else:
-        # logger.debug(line)
-        cat = None
+def get_unsafe_measure(rust_file_dir, proj_name, transpiler_name):
+    logger.info("Collecting unsafe metrics for Rust functions")
 
-    return cat
+    columns = ["id", "total_unsafe_block_R", "avg_unsafe_stmt_R"]
+    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
 
-def get_var_type_measure(rust_file_dir, proj_name, transpiler_name):
-    bin = "src/bin/dump-var-types"
-    logger.info("Collecting variable-type metric for Rust functions")
+    unsafe_measure_df = pandas.DataFrame(iter_unsafe_measure(rust_file_dir, proj_name), columns = columns)
+    return unsafe_measure_df
+
+# Type categories of the variable-type metric. The exact names are looked up
+# in a dict, the remaining names by their suffix and prefix, in the precedence
+# of the original if/elif chain
+type_cat_exact = {name: cat for cat, names in [
+        ("pointer", ["libc::c_void", "libc :: c_void"]),
+        ("integer", ["i64", "i32", "u64", "u32", "c_uint", "c_int", "libc :: c_int",
+                     "libc :: size_t", "size_t", "c_size_t", "usize", "isize",
+                     "u8", "i8", "i128", "u_int", "int"]),
+        ("float", ["f64", "f32", "float", "c_double"]),
+        ("string", ["string"]),
+        ("char", ["char", "c_char", "libc :: c_char"]),
+        ("bool", ["bool"]),
+        ("struct", ["libc::timespec"]),
+        ("vector", ["Vec<u8>", "Vec < u8 >"])] for name in names}
+
+type_cat_suffixes = [("c_ulong", "integer"), ("c_long", "integer")]
+
+# Prefix length -> {prefix: category}, none of the prefixes overlap
+type_cat_prefixes = {4: {"enum": "enum"},
+                     5: {"array": "array", "tuple": "tuple"},
+                     6: {"struct": "struct", "Option": "option"},
+                     7: {"HashMap": "hashmap"}}
+
+@functools.lru_cache(maxsize=None)
+def type_category(type_name):
+    if "NotIdentified#" in type_name:
+        return None
+    if type_name[:1] == "*" or type_name[:1] == "&":
+        return "pointer"
+    cat = type_cat_exact.get(type_name)
+    if cat is not None:
+        return cat
+    for suffix, cat in type_cat_suffixes:
+        if type_name.endswith(suffix):
+            return cat
+    for length, prefixes in type_cat_prefixes.items():
+        cat = prefixes.get(type_name[:length])
+        if cat is not None:
+            return cat
+    return None
 
-    var_type_measure_dict = {}
-    var_type_measure_ls = []
-    columns = ["id", "total_uniq_type_R"]
-    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
-    for rust_filename in os.listdir(rust_file_dir):
-        if not rust_filename.endswith(".rs"):
-            continue
+def get_type_cat(line):
+    return type_category(line[2])
+
+def get_type_cats(type_names):
+    # Categorizes a whole type column, every distinct name is classified once
+    cats = {x: type_category(x) for x in set(type_names)}
+    return [cats[x] for x in type_names]
+
+def iter_var_type_measure(rust_file_dir, proj_name):
+    # Yields one row of variable-type metrics per function, the tool runs once per unique source
+    bin = DUMP_VAR_TYPES_BIN
+    rust_filenames = [x for x in os.listdir(rust_file_dir) if x.endswith(".rs")]
+    progress = log.ProgressLogger(logger, "Rust variable-type " + proj_name, len(rust_filenames))
+    for rust_filename in rust_filenames:
         rust_file = os.path.join(rust_file_dir, rust_filename)
-
-        logger.debug("Processing: " + str(rust_file))
-        cmd = [bin, rust_file]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        reader = csv.reader(StringIO(out.decode()), delimiter=";")
+        progress.update()
+
+        digest = dedup.source_digest(rust_file)
+        lines = var_type_measure_cache.lookup(digest)
+        if lines is None:
+            start_time = time.time()
+            cmd = [bin, rust_file]
+            try:
+                returncode, out, err = tool_runner.run_tool("dump-var-types", cmd, item=rust_file)
+                lines = list(csv.reader(StringIO(out.decode()), delimiter=";"))
+            except tool_runner.ToolTimeout as ex:
+                logger.warning(str(ex))
+                lines = []
+            var_type_measure_cache.put(digest, lines, time.time() - start_time)
+        var_type_measure_cache.count(digest)
 
         basename = Path(os.path.basename(rust_file)).stem
         elems = basename.split("#")
@@ -294,11 +383,10 @@ def get_var_type_measure(rust_file_dir, proj_name, transpiler_name):
         else:
             logger.warning("File name format is not recognized")
         flag = 0
-        tmp_set = set()
         tmp_ls = []
         funcname = ""
 
-        for line in reader:
+        for line in lines:
 
             if line[0] == "Function" and line[1] == target_func_name:
                 if flag == 0:
@@ -312,64 +400,139 @@ def get_var_type_measure(rust_file_dir, proj_name, transpiler_name):
             if line[0] == "Function":
                 funcname = line[1]
             elif line[0] == "Argument":
-                cat = get_type_cat(line)
-                if not cat is None:
-                    tmp_ls.append(cat)
+                tmp_ls.append(line[2])
             elif line[0] == "Return":
                 pass
             elif line[0] == "Local":
-                cat = get_type_cat(line)
-                if not cat is None:
-                    tmp_ls.append(cat)
+                tmp_ls.append(line[2])
 
         if funcname == target_func_name:
-            var_type_measure_dict[proj_name + ":" + filename + ":" + funcname] = set(tmp_ls)
-            var_type_measure_ls.append([str(proj_name + ":" + filename + ":" + funcname), \
-                int(len(tmp_ls))])
+            tmp_ls = [x for x in get_type_cats(tmp_ls) if not x is None]
+            yield [str(proj_name + ":" + filename + ":" + funcname), \
+                int(len(tmp_ls))]
+    progress.done()
 
-    var_type_measure_df = pandas.DataFrame(var_type_measure_ls, columns = columns)
-    return var_type_measure_dict, var_type_measure_df
+def get_var_type_measure(rust_file_dir, proj_name, transpiler_name):
+    logger.info("Collecting variable-type metric for Rust functions")
 
-def get_metrics(c_file_dir, rust_dirs):
-    # Get each metric for the functions
-    metrics_dict = {"MI_Rust":{}, "unsafe_measure":{},\
-                     "var_type_measure":{}}
-    metrics_sum_dict = {"MI_Rust":{}, "unsafe_measure":{},\
-                        "var_type_measure":{}}
+    columns = ["id", "total_uniq_type_R"]
+    columns = ["id"] + [transpiler_name + "_" + x for x in columns if not str(x) == "id"]
 
+    var_type_measure_df = pandas.DataFrame(iter_var_type_measure(rust_file_dir, proj_name), columns = columns)
+    return var_type_measure_df
+
+def get_metrics(c_file_dir, rust_dirs, num_jobs=None):
+    # Get each metric for the functions of a project and merge them on the id.
+    # Only the metric rows are kept, the raw tool outputs are dropped as they are parsed.
     proj_name = Path(c_file_dir).parts[-2]
 
-    if len(rust_dirs) == 0:
-        metrics_dict["MI_C"], metrics_sum_dict["MI_C"] = get_MI_for_C(c_file_dir, proj_name)
-        merged_df = metrics_sum_dict["MI_C"]
-    else:
-        metrics_dict["MI_C"], metrics_sum_dict["MI_C"] = get_MI_for_C(c_file_dir, proj_name)
-        merged_df = metrics_sum_dict["MI_C"]
-        
+    with profiler.span("stage", "C MI", project=proj_name):
+        merged_df = get_MI_for_C(c_file_dir, proj_name)
+    profiler.count("C MI rows", len(merged_df))
+    if len(rust_dirs) != 0:
         for transpiler_name, rust_dir in [rust_dirs]:
-            tmp1, tmp2 = get_MI_for_Rust(rust_dir, proj_name, transpiler_name)
-            metrics_dict["MI_Rust"][transpiler_name] = tmp1
-            metrics_sum_dict["MI_Rust"][transpiler_name] = tmp2
-            merged_df = pandas.merge(merged_df, tmp2, on="id")
-            tmp1, tmp2 = get_unsafe_measure(rust_dir, proj_name, transpiler_name)
-            metrics_dict["unsafe_measure"][transpiler_name] = tmp1
-            metrics_sum_dict["unsafe_measure"][transpiler_name] = tmp2
-            merged_df = pandas.merge(merged_df, tmp2, on="id")
-            tmp1, tmp2 = get_var_type_measure(rust_dir, proj_name, transpiler_name)
-            metrics_dict["var_type_measure"][transpiler_name] = tmp1
-            metrics_sum_dict["var_type_measure"][transpiler_name] = tmp2
-            merged_df = pandas.merge(merged_df, tmp2, on="id")
+            for stage, get_measure in [("Rust MI", functools.partial(get_MI_for_Rust, num_jobs=num_jobs)),
+                                       ("unsafe", get_unsafe_measure), ("var-types", get_var_type_measure)]:
+                with profiler.span("stage", stage, project=proj_name):
+                    measure_df = get_measure(rust_dir, proj_name, transpiler_name)
+                profiler.count(stage + " rows", len(measure_df))
+                with profiler.span("stage", "merge", project=proj_name):
+                    merged_df = pandas.merge(merged_df, measure_df, on="id")
     
-    return metrics_dict, metrics_sum_dict, merged_df
+    return merged_df
 
-def PCA_analysis(df, chosen_metrics):
+def fit_summary_complexity(df, chosen_metrics):
     # Calculate single pca complexity metric from 4 metrics
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+
     X = df[chosen_metrics]
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
 
     pca = PCA(n_components=1)
-    df['summary_complexity_pca'] = pca.fit_transform(X_scaled) * -1
+    return pca.fit_transform(X_scaled)[:, 0] * -1
+
+summary_complexity_cache = {}
+
+def get_summary_complexity(df, chosen_metrics, metricfile=None):
+    # The PCA summary complexity only depends on the metric set, so it is
+    # computed once and cached in memory and alongside the metric store
+    if metricfile is None:
+        return fit_summary_complexity(df, chosen_metrics)
+
+    key = (metricfile, tuple(chosen_metrics), len(df))
+    if key in summary_complexity_cache:
+        return summary_complexity_cache[key]
+
+    scores = metric_store.load_derived(metricfile, "summary_complexity_pca", features=list(chosen_metrics))
+    if scores is None or len(scores) != len(df):
+        scores = fit_summary_complexity(df, chosen_metrics)
+        if metric_store.store_exists(metricfile):
+            metric_store.save_derived(metricfile, "summary_complexity_pca", [scores],
+                                      features=list(chosen_metrics), method="exact")
+    summary_complexity_cache[key] = scores
+    return scores
+
+def merge_moments(n, mean, comoment, X):
+    # Merge the mean and co-moment matrix of a new block of rows into the
+    # running statistics (parallel variant of Welford's algorithm)
+    n_new = len(X)
+    if n_new == 0:
+        return n, mean, comoment
+    mean_new = X.mean(axis=0)
+    centered = X - mean_new
+    delta = mean_new - mean
+    total = n + n_new
+    mean = mean + delta * n_new / total
+    comoment = comoment + centered.T @ centered + np.outer(delta, delta) * n * n_new / total
+    return total, mean, comoment
+
+def principal_axis(n, comoment):
+    # First principal axis of the standardized metrics from the running statistics.
+    # Constant metrics keep a unit scale, like StandardScaler does.
+    scale = np.sqrt(np.diag(comoment) / n)
+    scale[scale == 0] = 1.0
+    corr = comoment / n / np.outer(scale, scale)
+    eigvals, eigvecs = np.linalg.eigh(corr)
+    axis = eigvecs[:, -1]
+    # Same sign convention as sklearn: the largest loading is positive
+    axis = axis * np.sign(axis[np.argmax(np.abs(axis))])
+    return scale, axis
+
+def update_summary_complexity(metricfile, chosen_metrics, chunk_size=65536):
+    # Incremental PCA ordering for a growing metric store. Only the rows added since
+    # the last update are folded into the running statistics, and the projection is
+    # rewritten chunk by chunk, so the memory use does not depend on the corpus size.
+    manifest = metric_store.read_manifest(metricfile)
+    stats = manifest.get("pca")
+    num_metrics = len(chosen_metrics)
+    if stats is None or stats["features"] != list(chosen_metrics) or stats["n"] > manifest["rows"]:
+        n, mean, comoment = 0, np.zeros(num_metrics), np.zeros((num_metrics, num_metrics))
+    else:
+        n, mean, comoment = stats["n"], np.array(stats["mean"]), np.array(stats["comoment"])
+
+    for X in metric_store.iter_chunks(metricfile, chosen_metrics, start=n, chunk_size=chunk_size):
+        n, mean, comoment = merge_moments(n, mean, comoment, X)
+
+    manifest = metric_store.read_manifest(metricfile)
+    manifest["pca"] = {"features": list(chosen_metrics), "n": n,
+                       "mean": mean.tolist(), "comoment": comoment.tolist()}
+    metric_store.write_manifest(metricfile, manifest)
+    if n == 0:
+        return
+
+    scale, axis = principal_axis(n, comoment)
+    scores = (((X - mean) / scale) @ axis * -1 for X in
+              metric_store.iter_chunks(metricfile, chosen_metrics, chunk_size=chunk_size))
+    metric_store.save_derived(metricfile, "summary_complexity_pca", scores,
+                              features=list(chosen_metrics), method="incremental")
+    summary_complexity_cache.clear()
+
+def PCA_analysis(df, chosen_metrics, scores=None):
+    if scores is None:
+        scores = fit_summary_complexity(df, chosen_metrics)
+    df['summary_complexity_pca'] = scores
 
     # Sort the df by the PCA summary complexity score
     df_sorted = df.sort_values(by=['summary_complexity_pca', 'id'], ascending=[False, True])
@@ -388,31 +551,89 @@ def select_from_bins(bins, ratio_of_sampling):
     
     return selected_funcs_df
 
-def partition(df, features, num_bins = 5):
-    # Create bins for each feature
-    bin_columns = []
+def cell_sample_counts(starts, num_rows, ratios_of_sampling):
+    # Number of rows selected from every cell for every ratio of sampling, with the
+    # stride of each cell, as (counts, interval) of shape (ratios, cells)
+    ratios = np.atleast_1d(np.asarray(ratios_of_sampling, dtype=np.float64))[:, None]
+    sizes = np.diff(np.append(starts, num_rows))
+
+    sample_size = np.maximum(1, np.ceil(sizes * ratios)).astype(np.int64)
+    interval = sizes // sample_size
+    counts = (sizes + interval - 1) // interval
+    return counts, interval
+
+def selection_sizes(starts, num_rows, ratios_of_sampling):
+    # Size of the selection for every ratio of sampling, without selecting.
+    # Non-decreasing in the ratio.
+    return cell_sample_counts(starts, num_rows, ratios_of_sampling)[0].sum(axis=1)
+
+def select_from_cells(starts, num_rows, ratios_of_sampling):
+    # Vectorized stride sampling over the cells returned by partition_cells. Gives
+    # the same rows as select_from_bins, as positions into the partitioned df, for
+    # every ratio of sampling at once.
+    counts, interval = cell_sample_counts(starts, num_rows, ratios_of_sampling)
+
+    # Enumerate the k-th selected row of every (ratio, cell) pair
+    flat_counts = counts.ravel()
+    offsets = np.cumsum(flat_counts) - flat_counts
+    k = np.arange(flat_counts.sum()) - np.repeat(offsets, flat_counts)
+    positions = np.repeat(np.broadcast_to(starts, counts.shape).ravel(), flat_counts) + \
+        k * np.repeat(interval.ravel(), flat_counts)
+
+    return np.split(positions, np.cumsum(counts.sum(axis=1))[:-1])
+
+def encode_bins(df, features, num_bins):
+    # Encode the bin tuple of each row as a single integer cell code. The bins of
+    # each feature are ranked by their 'Bin_<i>' label, so that the cell codes
+    # sort in the same order as the sorted tuples of bin labels.
+    labels = [f'Bin_{i}' for i in range(1, num_bins + 1)]
+    label_rank = np.argsort(np.argsort(labels))
+
+    ranks = []
     for feature in features:
+        bin_idx = pandas.cut(df[feature], bins=num_bins, labels=False).to_numpy(dtype=np.int64)
         if feature == "MI_C" or feature == "qwen2_5_coder_32b_MI_R":
-            bins = pandas.cut(df[feature], bins=num_bins, labels=[f'Bin_{i}' for i in range(num_bins, 0, -1)])
+            # Higher MI means lower complexity, so the bins are labelled in reverse
+            ranks.append(label_rank[num_bins - 1 - bin_idx])
         else:
-            bins = pandas.cut(df[feature], bins=num_bins, labels=[f'Bin_{i}' for i in range(1, num_bins + 1)])
-        bin_columns.append(bins)
+            ranks.append(label_rank[bin_idx])
+
+    if len(features) * np.log2(max(num_bins, 2)) < 63:
+        codes = np.zeros(len(df), dtype=np.int64)
+        for rank in ranks:
+            codes = codes * num_bins + rank
+    else:
+        # Mixed-radix codes would overflow, fall back to ranking the unique rows
+        uniq, codes = np.unique(np.column_stack(ranks), axis=0, return_inverse=True)
+        codes = codes.reshape(-1).astype(np.int64)
+
+    return codes
 
-    # Create a new df for the bin columns
+def partition_cells(df, features, num_bins = 5, scores = None):
+    # Create a new df with the cell code of each sample
     bins_df = pandas.DataFrame({
         "id": df["id"],
-        **{f"{feature}_bin": bin for feature, bin in zip(features, bin_columns)},
         **{feature: df[feature] for feature in features}
     })
+    bins_df["cell"] = encode_bins(df, features, num_bins)
 
     # Get summarized pca compexity metric
-    df_with_pca = PCA_analysis(bins_df, features)
-
-    # Group the samples by the  combinations 
-    grouped = df_with_pca.groupby([f"{feature}_bin" for feature in features])
-    sorted_group_keys = sorted(grouped.groups.keys())
-    bins = []
-    for key in sorted_group_keys:
-        bins.append(grouped.get_group(key))
+    df_with_pca = PCA_analysis(bins_df, features, scores)
+
+    # Group the samples by cell with a stable sort, which keeps the PCA order
+    # inside each cell. Only the non-empty cells are visited.
+    order = np.argsort(df_with_pca["cell"].to_numpy(), kind="stable")
+    df_cells = df_with_pca.iloc[order]
+    cells = df_cells["cell"].to_numpy()
+    if len(cells) == 0:
+        return df_cells, np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+
+    return df_cells, starts
+
+def partition(df, features, num_bins = 5, scores = None):
+    df_cells, starts = partition_cells(df, features, num_bins, scores)
+    ends = np.append(starts[1:], len(df_cells))
+    bins = [df_cells.iloc[start:end] for start, end in zip(starts, ends)]
     
     return bins
@@ -0,0 +1,158 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columnar store for the collected metrics. Every metric column is kept as a
+# raw little-endian array in its own file and memory-mapped on load, so that
+# readers only touch the columns they project. The ids are kept in a plain
+# text table with one id per line, in the same row order as the columns.
+STORE_SUFFIX = ".store"
+MANIFEST_FILE = "manifest.json"
+ID_FILE = "id.txt"
+STORE_VERSION = 1
+
+def store_path(metricfile):
+    return metricfile + STORE_SUFFIX
+
+def store_exists(metricfile):
+    return os.path.isfile(os.path.join(store_path(metricfile), MANIFEST_FILE))
+
+def _column_file(path, column):
+    return os.path.join(path, column + ".bin")
+
+def read_manifest(metricfile):
+    with open(os.path.join(store_path(metricfile), MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+def write_manifest(metricfile, manifest):
+    # Write to a temporary file first so that readers never see a partial manifest
+    manifest_file = os.path.join(store_path(metricfile), MANIFEST_FILE)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def _column_dtype(series):
+    if pandas.api.types.is_integer_dtype(series.dtype):
+        return np.dtype("<i8")
+    elif pandas.api.types.is_numeric_dtype(series.dtype):
+        return np.dtype("<f8")
+    else:
+        raise ValueError("Column " + str(series.name) + " is not numeric")
+
+def remove_store(metricfile):
+    path = store_path(metricfile)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+def save_metrics(df, metricfile):
+    remove_store(metricfile)
+    append_metrics(df, metricfile)
+
+def append_metrics(df, metricfile):
+    path = store_path(metricfile)
+    columns = [x for x in df.columns if str(x) != "id"]
+
+    if store_exists(metricfile):
+        manifest = read_manifest(metricfile)
+        stored_columns = [c["name"] for c in manifest["columns"]]
+        if stored_columns != columns:
+            raise ValueError("Columns do not match the existing store: " + str(columns))
+    else:
+        os.makedirs(path, exist_ok=True)
+        manifest = {"version": STORE_VERSION, "rows": 0,
+                    "columns": [{"name": c, "dtype": _column_dtype(df[c]).str} for c in columns]}
+        # Start from empty files to not pick up the leftovers of an interrupted write
+        for c in columns:
+            open(_column_file(path, c), "wb").close()
+        open(os.path.join(path, ID_FILE), "w").close()
+
+    for column in manifest["columns"]:
+        arr = np.ascontiguousarray(df[column["name"]].to_numpy(dtype=np.dtype(column["dtype"])))
+        with open(_column_file(path, column["name"]), "ab") as f:
+            f.write(arr.tobytes())
+
+    with open(os.path.join(path, ID_FILE), "a") as f:
+        for id in df["id"]:
+            f.write(str(id) + "\n")
+
+    manifest["rows"] += len(df)
+    # Derived columns (e.g. cached projections) are stale once new rows arrive
+    manifest.pop("derived", None)
+    write_manifest(metricfile, manifest)
+
+def load_column(metricfile, column, manifest=None):
+    # Memory-mapped, read-only view on a single column
+    if manifest is None:
+        manifest = read_manifest(metricfile)
+    for c in manifest["columns"] + manifest.get("derived", []):
+        if c["name"] == column:
+            if manifest["rows"] == 0:
+                return np.empty(0, dtype=np.dtype(c["dtype"]))
+            return np.memmap(_column_file(store_path(metricfile), column),
+                             dtype=np.dtype(c["dtype"]), mode="r", shape=(manifest["rows"],))
+    raise KeyError(column)
+
+def load_ids(metricfile):
+    with open(os.path.join(store_path(metricfile), ID_FILE), "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+def load_metrics(metricfile, columns=None):
+    # Load the id column plus the projected metric columns (all columns if None).
+    # Falls back to the legacy pickle dump when no store has been written yet.
+    if not store_exists(metricfile):
+        logger.info("No metric store found, reading " + metricfile + ".pkl")
+        df = pandas.read_pickle(metricfile + ".pkl")
+        if columns is not None:
+            df = df[["id"] + [c for c in columns if c != "id"]]
+        return df
+
+    manifest = read_manifest(metricfile)
+    if columns is None:
+        columns = [c["name"] for c in manifest["columns"]]
+    data = {"id": load_ids(metricfile)}
+    for column in columns:
+        if column != "id":
+            data[column] = load_column(metricfile, column, manifest)
+
+    return pandas.DataFrame(data, copy=False)
+
+def iter_chunks(metricfile, columns, start=0, chunk_size=65536):
+    # Yields the projected columns as float64 blocks of at most chunk_size rows
+    manifest = read_manifest(metricfile)
+    arrays = [load_column(metricfile, c, manifest) for c in columns]
+    for chunk_start in range(start, manifest["rows"], chunk_size):
+        yield np.column_stack([np.asarray(a[chunk_start:chunk_start + chunk_size], dtype=np.float64) for a in arrays])
+
+def save_derived(metricfile, name, chunks, **meta):
+    # Store a float64 column computed from the metrics (e.g. a cached projection).
+    # The column is written chunk by chunk and dropped on the next append.
+    with open(_column_file(store_path(metricfile), name), "wb") as f:
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype="<f8").tobytes())
+
+    manifest = read_manifest(metricfile)
+    derived = [c for c in manifest.get("derived", []) if c["name"] != name]
+    derived.append({"name": name, "dtype": "<f8", **meta})
+    manifest["derived"] = derived
+    write_manifest(metricfile, manifest)
+
+def load_derived(metricfile, name, **meta):
+    # Returns the derived column if it was computed with the given meta data, None otherwise
+    if not store_exists(metricfile):
+        return None
+    manifest = read_manifest(metricfile)
+    for c in manifest.get("derived", []):
+        if c["name"] == name and all(c.get(k) == v for k, v in meta.items()):
+            return load_column(metricfile, name, manifest)
+    return None
+
+def convert_pickle(metricfile):
+    df = pandas.read_pickle(metricfile + ".pkl")
+    save_metrics(df, metricfile)
+    return df
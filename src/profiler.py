@@ -0,0 +1,79 @@
+import os
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Timers and counters of the pipeline, grouped by kind (stage, project, tool).
+# Nothing is recorded unless enable() was called, e.g. through --profile.
+enabled = False
+tracing = False
+timers = {}
+counters = {}
+trace_events = []
+start_time = time.perf_counter()
+
+def enable(trace=False):
+    global enabled, tracing
+    enabled = True
+    tracing = trace
+
+def add_span(kind, name, span_start, elapsed, **args):
+    # span_start is a time.perf_counter() value
+    if not enabled:
+        return
+    timer = timers.setdefault((kind, name), [0, 0.0, 0.0])
+    timer[0] += 1
+    timer[1] += elapsed
+    timer[2] = max(timer[2], elapsed)
+    if tracing:
+        trace_events.append({"name": name, "cat": kind, "ph": "X",
+                             "ts": round((span_start - start_time) * 1e6, 1), "dur": round(elapsed * 1e6, 1),
+                             "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+@contextmanager
+def span(kind, name, **args):
+    span_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(kind, name, span_start, time.perf_counter() - span_start, **args)
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+def summary():
+    rows = []
+    for (kind, name), (calls, total, longest) in sorted(timers.items(), key=lambda x: -x[1][1]):
+        rows.append({"kind": kind, "name": name, "calls": calls, "total_s": round(total, 6),
+                     "mean_s": round(total / calls, 6), "max_s": round(longest, 6)})
+    return rows
+
+def write_profile(prefix):
+    # Writes <prefix>.json and <prefix>.csv, and <prefix>.trace.json when tracing,
+    # which can be opened in chrome://tracing or Perfetto
+    rows = summary()
+    with open(prefix + ".json", "w") as f:
+        json.dump({"wall_time_s": round(time.perf_counter() - start_time, 6),
+                   "timers": rows, "counters": counters}, f, indent=1)
+    with open(prefix + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["kind", "name", "calls", "total_s", "mean_s", "max_s"], delimiter=";")
+        writer.writeheader()
+        writer.writerows(rows)
+    logger.info("Profile written to " + prefix + ".json and " + prefix + ".csv")
+
+    if tracing:
+        with open(prefix + ".trace.json", "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        logger.info("Trace written to " + prefix + ".trace.json")
+
+    for row in rows:
+        if row["kind"] != "tool":
+            logger.info(row["kind"] + " " + row["name"] + ": " + str(round(row["total_s"], 2)) +
+                        "s in " + str(row["calls"]) + " calls")
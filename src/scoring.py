@@ -0,0 +1,368 @@
+from collections import Counter
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Scoring of a selection: the relative difference (%) between the histogram of the
+# compilation error fixing attempts of the whole set and that of the selected
+# functions, over 0-20 attempts. The histogram of the whole set is scaled down to
+# the size of the selection (ceil), and an attempt count missing from the whole
+# set counts as 1.
+NUM_OF_ATTEMPT_KEYS = 21
+
+def log_key(id):
+    # Functions are identified as proj:file:func in the metrics and as proj#file#func.c in the log
+    return id.replace(":", "#") + ".c"
+
+# Fields of a log line. Lines written with more than one candidate translation
+# have two more, and their comp_attempt is that of the best candidate, which does
+# not describe the model, so they are not scored.
+NUM_OF_LOG_FIELDS = 8
+
+def check_log_fields(transpilation_log_file, elems):
+    if len(elems) > NUM_OF_LOG_FIELDS:
+        raise ValueError(str(transpilation_log_file) + " was written with --candidates, its comp_attempt of " +
+                         elems[0] + " is that of the best candidate and cannot be scored")
+
+def load_transpilation_log(transpilation_log_file, ids):
+    # First log line of every function of the metric set, as its list of fields
+    alive_funcs = set(log_key(x) for x in ids)
+    with open(transpilation_log_file, "r") as f:
+        transpilation_log_lines = [line.strip() for line in f.readlines()]
+
+    transpilation_log_dict = {}
+    for line in transpilation_log_lines:
+        elems = line.split(";")
+        check_log_fields(transpilation_log_file, elems)
+        if not elems[0] in transpilation_log_dict.keys() and elems[0] in alive_funcs:
+            transpilation_log_dict[elems[0]] = elems
+
+    return transpilation_log_dict
+
+def get_logs_for_selected(transpilation_log_dict, selected_functions_list):
+    selected_transpilation_log_dict = {}
+    for line in selected_functions_list:
+        if not line in selected_transpilation_log_dict.keys():
+            selected_transpilation_log_dict[line] = transpilation_log_dict[line]
+
+    return selected_transpilation_log_dict
+
+def get_comp_attempts(transpilation_log_dict):
+
+    comp_attemps = []
+    for k in transpilation_log_dict.keys():
+        comp_attemps.append(transpilation_log_dict[k][4])
+
+    return comp_attemps
+
+def get_frequencies(comp_attempts, selected_comp_attempts):
+    # Normalize the distribution for the original set to overcome differences between two sets
+    ratio = len(selected_comp_attempts) / len(comp_attempts)
+
+    freq = Counter(comp_attempts)
+    freq = {key: np.ceil(value * ratio) for key, value in freq.items()}
+
+    selected_freq = Counter(selected_comp_attempts)
+
+    all_keys = [str(key) for key in range(0, NUM_OF_ATTEMPT_KEYS)]
+
+    # Get the frequency values for each list (default to 1.0 if the number is not in the list)
+    freq_values = [freq.get(str(key), 1.0) for key in all_keys]
+    selected_freq_values = [selected_freq.get(str(key), 0) for key in all_keys]
+
+    return freq_values, selected_freq_values, all_keys
+
+def relative_diff(freq_values, selected_freq_values):
+    denom = min(len(freq_values), len(selected_freq_values))
+    return (sum((abs(a - b) / a) for a, b in zip(freq_values, selected_freq_values)) / denom) * 100
+
+def score_selection(transpilation_log_dict, selected_functions_list):
+    selected_transpilation_log_dict = get_logs_for_selected(transpilation_log_dict, selected_functions_list)
+
+    comp_attempts = get_comp_attempts(transpilation_log_dict)
+    selected_comp_attempts = get_comp_attempts(selected_transpilation_log_dict)
+
+    freq_values, selected_freq_values, all_keys = \
+                        get_frequencies(comp_attempts,selected_comp_attempts)
+
+    return relative_diff(freq_values, selected_freq_values), freq_values, selected_freq_values, all_keys
+
+def attempt_code(attempts):
+    # The logged attempt count (0-20) or NUM_OF_ATTEMPT_KEYS for a value outside of the histogram
+    return int(attempts) if attempts.isdigit() and int(attempts) < NUM_OF_ATTEMPT_KEYS else NUM_OF_ATTEMPT_KEYS
+
+def comp_attempt_codes(transpilation_log_dict, ids):
+    # Per metric row: the attempt code, -1 for a function missing from the log
+    codes = np.full(len(ids), -1, dtype=np.int64)
+    for i, id in enumerate(ids):
+        elems = transpilation_log_dict.get(log_key(id))
+        if elems is None:
+            continue
+        codes[i] = attempt_code(elems[4])
+    return codes
+
+class SelectionScorer:
+    # Scores selections given as row positions in memory, with the same result
+    # as score_selection on the written selection
+
+    def __init__(self, codes):
+        self.codes = codes
+        logged = codes[codes >= 0]
+        self.num_logged = len(logged)
+        counts = np.bincount(logged, minlength=NUM_OF_ATTEMPT_KEYS + 1)[:NUM_OF_ATTEMPT_KEYS]
+        self.counts = counts.astype(np.float64)
+        self.missing = counts == 0
+
+    def score(self, positions):
+        selected = self.codes[positions]
+        if (selected < 0).any():
+            raise KeyError("Selected functions missing from the transpilation log")
+        ratio = len(selected) / self.num_logged
+        freq_values = np.where(self.missing, 1.0, np.ceil(self.counts * ratio))
+        selected_freq_values = np.bincount(selected, minlength=NUM_OF_ATTEMPT_KEYS + 1)[:NUM_OF_ATTEMPT_KEYS]
+        # Summed in order as in relative_diff, so that the scores (and their ties) are identical
+        return (sum((np.abs(freq_values - selected_freq_values) / freq_values).tolist()) / NUM_OF_ATTEMPT_KEYS) * 100
+
+def multinomial_draws(rng, n, pvals):
+    # One multinomial draw per row of pvals (rows, categories) with n[row] trials,
+    # as a sequence of conditional binomial draws, which vectorizes over the rows
+    # (Generator.multinomial only broadcasts pvals from numpy 1.22 on)
+    n = np.asarray(n, dtype=np.int64)
+    draws = np.zeros(pvals.shape, dtype=np.int64)
+    remaining = n.copy()
+    p_remaining = np.ones(len(pvals))
+    for k in range(pvals.shape[1] - 1):
+        p = np.clip(np.divide(pvals[:, k], p_remaining, out=np.zeros(len(pvals)), where=p_remaining > 0), 0.0, 1.0)
+        draws[:, k] = rng.binomial(remaining, p)
+        remaining -= draws[:, k]
+        p_remaining -= pvals[:, k]
+    draws[:, -1] = remaining
+    return draws
+
+def relative_diffs(counts, selected_counts):
+    # relative_diff of the selected histogram against every row of counts, both
+    # given as attempt code counts (rows, NUM_OF_ATTEMPT_KEYS + 1)
+    ratio = selected_counts.sum() / counts.sum(axis=1, keepdims=True)
+    counts = counts[:, :NUM_OF_ATTEMPT_KEYS]
+    freq_values = np.where(counts == 0, 1.0, np.ceil(counts * ratio))
+    return np.abs(freq_values - selected_counts[:NUM_OF_ATTEMPT_KEYS]) / freq_values * 100 / NUM_OF_ATTEMPT_KEYS
+
+def redraw_scores(codes, starts, interval, num_draws, rng, max_rows=200000):
+    # Relative difference scores of stride selections from the same cells with a
+    # random first row. codes are the attempt codes of the partitioned rows (see
+    # comp_attempt_codes), starts the first row of every cell and interval the
+    # stride of every (ratio, cell) pair as given by measure.cell_sample_counts.
+    # In every draw, each cell selects every interval-th row from a random offset
+    # below the interval, the same for all the ratios, instead of from its first
+    # row. The offset 0 is the selection itself. The whole set stays fixed, and
+    # functions missing from the log are left out of the selected histograms.
+    # Returns the scores of num_draws draws per ratio (ratios, num_draws).
+    num_keys = NUM_OF_ATTEMPT_KEYS + 2
+    keys = np.where(codes < 0, NUM_OF_ATTEMPT_KEYS + 1, codes)
+    counts = np.bincount(codes[codes >= 0], minlength=NUM_OF_ATTEMPT_KEYS + 1)[:NUM_OF_ATTEMPT_KEYS]
+    num_logged = (codes >= 0).sum()
+    sizes = np.diff(np.append(starts, len(codes)))
+
+    # Histograms of the rows of every residue of every distinct (cell, stride) pair
+    cells = np.broadcast_to(np.arange(len(starts)), interval.shape)
+    pair_keys, pair_index = np.unique(np.stack([cells.ravel(), interval.ravel()]), axis=1, return_inverse=True)
+    pair_index = pair_index.reshape(interval.shape)
+    pair_cells, pair_strides = pair_keys
+    pair_offsets = np.cumsum(pair_strides) - pair_strides
+    row_pairs = np.repeat(np.arange(len(pair_cells)), sizes[pair_cells])
+    rows = np.arange(len(row_pairs)) - np.repeat(np.cumsum(sizes[pair_cells]) - sizes[pair_cells], sizes[pair_cells])
+    residues = np.bincount((pair_offsets[row_pairs] + rows % pair_strides[row_pairs]) * num_keys +
+                           keys[starts[pair_cells[row_pairs]] + rows], minlength=pair_strides.sum() * num_keys)
+    residues = residues.reshape(-1, num_keys)
+
+    # The selected histogram of a ratio is that of the previous ratio, updated by
+    # the cells whose stride changes
+    changed = np.ones(interval.shape, dtype=bool)
+    changed[1:] = pair_index[1:] != pair_index[:-1]
+    change_ratio, change_cell = np.nonzero(changed)
+    new_pairs = pair_index[change_ratio, change_cell]
+    old_pairs = np.where(change_ratio > 0, pair_index[np.maximum(0, change_ratio - 1), change_cell], -1)
+    last_change = np.searchsorted(change_ratio, np.arange(len(interval)), side="right") - 1
+
+    scores = np.empty((len(interval), num_draws))
+    chunk = max(1, max_rows // len(change_ratio))
+    for begin in range(0, num_draws, chunk):
+        end = min(begin + chunk, num_draws)
+        offsets = rng.random((end - begin, len(starts)))
+        pair_rows = pair_offsets + (offsets[:, pair_cells] * pair_strides).astype(np.int64)
+        deltas = residues[pair_rows[:, new_pairs]]
+        deltas[:, change_ratio > 0] -= residues[pair_rows[:, old_pairs[change_ratio > 0]]]
+        selected_counts = np.cumsum(deltas, axis=1)[:, last_change]
+        ratio = selected_counts[:, :, :NUM_OF_ATTEMPT_KEYS + 1].sum(axis=2, keepdims=True) / num_logged
+        freq_values = np.where(counts == 0, 1.0, np.ceil(counts * ratio))
+        diffs = np.abs(freq_values - selected_counts[:, :, :NUM_OF_ATTEMPT_KEYS]) / freq_values
+        scores[:, begin:end] = (diffs.sum(axis=2) / NUM_OF_ATTEMPT_KEYS * 100).T
+    return scores
+
+def redraw_quantiles(scores, redrawn):
+    # Where the scores of the redrawn selections (see redraw_scores), given per
+    # selection (selections, draws), lie: their 2.5th, 50th and 97.5th percentiles,
+    # and the percentile of the score of the selection itself among them (ties
+    # count half). The redraws describe the combination rather than the selection,
+    # so they are not an interval of its score: a low percentile means that the
+    # selection scores better than its combination usually does.
+    # Returns (p2_5, median, p97_5, percentile) per selection.
+    scores = np.asarray(scores, dtype=np.float64)[:, None]
+    p2_5, median, p97_5 = np.quantile(redrawn, [0.025, 0.5, 0.975], axis=1)
+    percentile = ((redrawn < scores).sum(axis=1) + (redrawn == scores).sum(axis=1) / 2) * 100 / redrawn.shape[1]
+    return p2_5, median, p97_5, percentile
+
+class ProgressiveEstimate:
+    # Estimate of the comp_attempt histogram of a selection from the functions
+    # transpiled so far, with the distribution of its error against the histogram
+    # of the whole selection. strata holds the stratum of every selected function.
+    #
+    # Two errors are tracked, both zero once all functions are done:
+    #   histogram: largest difference in the share of an attempt count between the
+    #              stratified estimate and the whole selection, in percentage points
+    #   score:     relative difference score of the functions done so far against
+    #              the whole selection, in excess of the score of the whole selection
+    #              against itself (1/21 for every attempt count it lacks). A single
+    #              function with a rare attempt count weighs as much as a common
+    #              count, so it only settles once almost all functions are done.
+    # Their distributions are simulated by completing the selection num_draws times:
+    # the remaining functions of every stratum are drawn from a Dirichlet posterior
+    # of the attempt codes of the stratum. Its prior is the share of the codes of the
+    # whole sample plus alpha spread evenly over all the codes, so that a code not
+    # seen yet keeps some mass and a homogeneous early sample has no zero-width bounds.
+
+    def __init__(self, strata, num_draws=2000, confidence=0.95, seed=0, alpha=1.0):
+        self.strata = np.asarray(strata, dtype=np.int64)
+        self.num_strata = int(self.strata.max()) + 1 if len(self.strata) else 0
+        self.num_draws = num_draws
+        self.confidence = confidence
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        self.remaining = np.bincount(self.strata, minlength=self.num_strata)
+        self.counts = np.zeros((self.num_strata, NUM_OF_ATTEMPT_KEYS + 1), dtype=np.int64)
+
+    def add(self, index, code):
+        stratum = self.strata[index]
+        self.remaining[stratum] -= 1
+        self.counts[stratum, code] += 1
+
+    def num_done(self):
+        return int(self.counts.sum())
+
+    def histogram(self):
+        # Estimated share of every attempt code, strata weighted by their size
+        sizes = self.counts.sum(axis=1) + self.remaining
+        done = self.counts.sum(axis=1)
+        pooled = self.counts.sum(axis=0) / max(1, self.num_done())
+        shares = np.where(done[:, None] > 0, self.counts / np.maximum(1, done)[:, None], pooled)
+        return (shares * sizes[:, None]).sum(axis=0) / sizes.sum()
+
+    def intervals(self):
+        # {"histogram": (median, lower, upper), "score": (median, lower, upper)} of the errors
+        selected_counts = self.counts.sum(axis=0)
+        if selected_counts.sum() == 0:
+            return {"histogram": (100.0, 0.0, 100.0), "score": (100.0, 0.0, 100.0)}
+        prior = selected_counts / selected_counts.sum() + self.alpha / (NUM_OF_ATTEMPT_KEYS + 1)
+        completed = np.broadcast_to(selected_counts, (self.num_draws, NUM_OF_ATTEMPT_KEYS + 1)).copy()
+        for stratum in np.flatnonzero(self.remaining):
+            pvals = self.rng.dirichlet(self.counts[stratum] + prior, size=self.num_draws)
+            completed += multinomial_draws(self.rng, np.full(self.num_draws, self.remaining[stratum]), pvals)
+
+        errors = {}
+        errors["histogram"] = np.abs(self.histogram() - completed / len(self.strata)).max(axis=1) * 100
+        floor = (completed[:, :NUM_OF_ATTEMPT_KEYS] == 0).sum(axis=1) * 100 / NUM_OF_ATTEMPT_KEYS
+        errors["score"] = relative_diffs(completed, selected_counts).sum(axis=1) - floor
+
+        alpha = (1 - self.confidence) / 2
+        intervals = {}
+        for name, values in errors.items():
+            lower, median, upper = np.quantile(values, [alpha, 0.5, 1 - alpha])
+            intervals[name] = (float(median), float(lower), float(upper))
+        return intervals
+
+# Numeric fields of a transpilation log line, as (field index, name, kind). The
+# attempts are bucketed as above, other counts likewise up to their largest value
+# in the whole set, and the times (s) into equal-frequency buckets of the whole set.
+LOG_COLUMNS = [
+    (3, "transpilation_time", "time"),
+    (4, "comp_attempt", "attempts"),
+    (5, "comp_fix_time", "time"),
+    (6, "post_process_iter", "count"),
+    (7, "post_process_time", "time"),
+]
+
+def log_column_values(transpilation_log_dict, ids):
+    # Per metric row: the numeric log fields (rows, len(LOG_COLUMNS)), nan for a
+    # function missing from the log or a field that is not a number
+    values = np.full((len(ids), len(LOG_COLUMNS)), np.nan)
+    for i, id in enumerate(ids):
+        elems = transpilation_log_dict.get(log_key(id))
+        if elems is None:
+            continue
+        for j, (field, name, kind) in enumerate(LOG_COLUMNS):
+            try:
+                values[i, j] = float(elems[field])
+            except (IndexError, ValueError):
+                pass
+    return values
+
+def relative_diff_counts(counts, selected_counts, num_keys):
+    # relative_diff of two bucket histograms, whose first num_keys buckets are compared
+    ratio = selected_counts.sum() / counts.sum()
+    freq_values = np.where(counts[:num_keys] == 0, 1.0, np.ceil(counts[:num_keys] * ratio))
+    return (sum((np.abs(freq_values - selected_counts[:num_keys]) / freq_values).tolist()) / num_keys) * 100
+
+class DistributionScorer:
+    # Scores selections, given as row positions, against the whole set on every
+    # numeric log column at once:
+    #   relative_diff: as for the attempts, over the buckets of the column
+    #   ks:            largest difference between the two empirical CDFs
+    #   wasserstein:   area between the two CDFs, in the unit of the column
+    # A selection is a subset of the whole set, so both CDFs only step at the
+    # distinct values of the whole set. These are sorted once, with the index of
+    # the value of every row, and a selection only takes a bincount per column.
+
+    def __init__(self, values):
+        self.columns = []
+        for j, (field, name, kind) in enumerate(LOG_COLUMNS):
+            column = values[:, j]
+            valid = ~np.isnan(column)
+            distinct, inverse = np.unique(column[valid], return_inverse=True)
+            value_index = np.full(len(column), -1, dtype=np.int64)
+            value_index[valid] = inverse.ravel()
+            counts = np.bincount(value_index[valid], minlength=len(distinct))
+            cdf = np.cumsum(counts) / max(1, valid.sum())
+
+            if kind != "time":
+                num_keys = NUM_OF_ATTEMPT_KEYS
+                if kind == "count" and len(distinct):
+                    num_keys = int(min(NUM_OF_ATTEMPT_KEYS, max(0, distinct.max()) + 1))
+                bucket_of_value = np.where((distinct >= 0) & (distinct < num_keys) & (distinct == np.floor(distinct)),
+                                           distinct, num_keys).astype(np.int64)
+            else:
+                edges = np.unique(np.quantile(column[valid], np.linspace(0, 1, NUM_OF_ATTEMPT_KEYS + 1)[1:-1])) \
+                        if len(distinct) else np.array([])
+                num_keys = len(edges) + 1
+                bucket_of_value = np.searchsorted(edges, distinct, side="right")
+            bucket_counts = np.bincount(bucket_of_value[value_index[valid]], minlength=num_keys + 1)
+            self.columns.append((name, distinct, value_index, cdf, bucket_of_value, bucket_counts, num_keys))
+
+    def score(self, positions):
+        # {column name: (relative_diff, ks, wasserstein)}, nan for a column without
+        # a value in the selection
+        scores = {}
+        for name, distinct, value_index, cdf, bucket_of_value, bucket_counts, num_keys in self.columns:
+            selected = value_index[positions]
+            selected = selected[selected >= 0]
+            if len(selected) == 0:
+                scores[name] = (np.nan, np.nan, np.nan)
+                continue
+            counts = np.bincount(selected, minlength=len(distinct))
+            difference = np.abs(cdf - np.cumsum(counts) / len(selected))
+            selected_buckets = np.bincount(bucket_of_value[selected], minlength=num_keys + 1)
+            scores[name] = (relative_diff_counts(bucket_counts, selected_buckets, num_keys),
+                            float(difference.max()),
+                            float((difference[:-1] * np.diff(distinct)).sum()))
+        return scores
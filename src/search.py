@@ -0,0 +1,110 @@
+import math
+
+import measure
+import scoring
+import profiler
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SweepEvaluator:
+    # Scores single (num_of_partition, ratio index) points of the tune grid on
+    # demand. Every number of partitions is partitioned once, when first needed.
+
+    def __init__(self, df, features, scores, transpilation_log_dict, ratios_of_sampling):
+        self.df = df
+        self.features = features
+        self.scores = scores
+        self.transpilation_log_dict = transpilation_log_dict
+        self.ratios_of_sampling = ratios_of_sampling
+        self.partitionings = {}
+        self.results = {}
+        self.num_evaluations = 0
+
+    def partitioning(self, num_of_partition):
+        if num_of_partition not in self.partitionings:
+            with profiler.span("stage", "partition"):
+                df_cells, starts = measure.partition_cells(self.df, self.features, num_of_partition, self.scores)
+                ids = df_cells["id"].to_numpy()
+                counts, interval = measure.cell_sample_counts(starts, len(ids), self.ratios_of_sampling)
+                sizes = counts.sum(axis=1)
+                # Neighbouring ratios often select the same rows, they are scored once
+                first_index = {}
+                same_as = [first_index.setdefault((c.tobytes(), i.tobytes()), index)
+                           for index, (c, i) in enumerate(zip(counts, interval))]
+            with profiler.span("stage", "score"):
+                scorer = scoring.SelectionScorer(scoring.comp_attempt_codes(self.transpilation_log_dict, ids))
+            self.partitionings[num_of_partition] = (ids, starts, sizes, same_as, scorer)
+        return self.partitionings[num_of_partition]
+
+    def num_feasible(self, num_of_partition, max_selected):
+        # The selection size grows with the ratio, so the ratios that select at
+        # most max_selected functions are a prefix of the grid
+        ids, starts, sizes, same_as, scorer = self.partitioning(num_of_partition)
+        if max_selected is None:
+            return len(sizes)
+        return int((sizes <= max_selected).sum())
+
+    def positions(self, num_of_partition, index):
+        ids, starts, sizes, same_as, scorer = self.partitioning(num_of_partition)
+        return measure.select_from_cells(starts, len(ids), [self.ratios_of_sampling[index]])[0]
+
+    def evaluate(self, num_of_partition, index):
+        # (relative_diff, num_of_partition, index), which orders the points like the sweep
+        key = (num_of_partition, index)
+        if key not in self.results:
+            ids, starts, sizes, same_as, scorer = self.partitioning(num_of_partition)
+            with profiler.span("stage", "score"):
+                diff = scorer.score(self.positions(num_of_partition, index))
+            self.num_evaluations += 1
+            profiler.count("selections")
+            for other in range(len(same_as)):
+                if same_as[other] == same_as[index]:
+                    self.results[(num_of_partition, other)] = diff
+        return (self.results[key], num_of_partition, index)
+
+    def selection(self, num_of_partition, index):
+        ids, starts, sizes, same_as, scorer = self.partitioning(num_of_partition)
+        return ids[self.positions(num_of_partition, index)]
+
+    def ranked(self):
+        # Evaluated points as (relative_diff, num_of_partition, ratio_of_sampling, num_of_bins, num_selected)
+        results = []
+        for (num_of_partition, index), diff in sorted(self.results.items(), key=lambda x: (x[1], x[0])):
+            ids, starts, sizes, same_as, scorer = self.partitionings[num_of_partition]
+            results.append((diff, num_of_partition, self.ratios_of_sampling[index], len(starts), int(sizes[index])))
+        return results
+
+def successive_halving(evaluator, partitions, max_selected=None, step=2):
+    # Two-pass search over the tune grid. The coarse pass scores every step-th
+    # feasible ratio (and the largest feasible one) of every number of partitions.
+    # The exhaustive pass keeps the better half of the numbers of partitions and
+    # scores every distinct feasible ratio of them, so that their best point is exact.
+    # Returns the best point as (diff, num_of_partition, index).
+    limits = {}
+    for num_of_partition in partitions:
+        limit = evaluator.num_feasible(num_of_partition, max_selected)
+        if limit > 0:
+            limits[num_of_partition] = limit
+    if not limits:
+        return None
+
+    for num_of_partition, limit in limits.items():
+        for index in sorted(set(range(step - 1, limit, step)) | {limit - 1}):
+            evaluator.evaluate(num_of_partition, index)
+
+    def best_of(num_of_partition):
+        return min(evaluator.evaluate(p, i) for p, i in evaluator.results if p == num_of_partition)
+
+    candidates = sorted(limits, key=best_of)[:math.ceil(len(limits) / 2)]
+    for num_of_partition in candidates:
+        # Identical selections are scored once by evaluate
+        ids, starts, sizes, same_as, scorer = evaluator.partitioning(num_of_partition)
+        for index in range(limits[num_of_partition]):
+            if same_as[index] == index:
+                evaluator.evaluate(num_of_partition, index)
+    logger.debug(str(len(candidates)) + " numbers of partitions scored exhaustively, " +
+                 str(evaluator.num_evaluations) + " selections scored")
+
+    return min(evaluator.evaluate(p, i) for p, i in evaluator.results)
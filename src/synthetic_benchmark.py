@@ -0,0 +1,139 @@
+import os
+import sys
+import random
+from optparse import OptionParser
+
+import logging
+import log
+logger = logging.getLogger(__name__)
+
+PROGRAM_USAGE = "Usage: \n"\
+                "%prog -o [output_benchmark_dir] [--projects 10] [--functions 1500] [--model qwen2_5_coder_32b]\n"
+
+# Generates a benchmark tree with the layout of Benchmark/<set>/ for load-testing
+# the pipeline without the real benchmark:
+#   <proj>/preprocessed_sf/<proj>#<file>#<func>.c
+#   <proj>/rust_<model>_sf_withfixing/<proj>#<file>#<func>.rs
+#   <proj>/rust_<model>_sf_withfixing/transpilation.log
+
+c_types = ["int", "unsigned int", "long", "char", "double", "size_t"]
+rust_types = {"int": "i32", "unsigned int": "u32", "long": "libc::c_long", "char": "libc::c_char",
+              "double": "f64", "size_t": "usize"}
+
+def parse_args():
+    """Parse and validate command line arguments."""
+    parser = OptionParser(usage=PROGRAM_USAGE)
+
+    parser.add_option('-o', '--out', action='store', type='str',
+            default=None, help="Directory to generate the benchmark into")
+    parser.add_option('--projects', action='store', type='int',
+            default=10, help="Number of projects")
+    parser.add_option('--functions', action='store', type='int',
+            default=1500, help="Number of functions per project")
+    parser.add_option('--files', action='store', type='int',
+            default=20, help="Number of source files per project the functions are spread over")
+    parser.add_option('--dup_ratio', action='store', type='float',
+            default=0.05, help="Ratio of functions that duplicate another function up to whitespace")
+    parser.add_option('--model', action='store', type='str',
+            default="qwen2_5_coder_32b", help="Transpiler name used in the Rust directory name")
+    parser.add_option('--no_rust', action='store_true', default=False,
+            help="Only generate the C functions and empty Rust directories, e.g. to load-test the transpiler")
+    parser.add_option('--seed', action='store', type='int',
+            default=0, help="Random seed")
+
+    opts, args = parser.parse_args()
+
+    if opts.out is None:
+        parser.print_help()
+        print("Output directory must be set", file=sys.stderr)
+        sys.exit(1)
+
+    return (opts, args)
+
+def generate_function(rnd, funcname):
+    # A C function and its transpilation with a size drawn from a heavy-tailed
+    # distribution, as in the real sets most functions are small
+    num_params = rnd.randint(0, 4)
+    num_locals = rnd.randint(0, 6)
+    num_stmts = min(200, int(rnd.paretovariate(1.5) * 3))
+    num_unsafe = rnd.choice([0, 0, 0, 1, 2])
+
+    params = [(rnd.choice(c_types), "p" + str(i)) for i in range(num_params)]
+    local_vars = [(rnd.choice(c_types), "v" + str(i)) for i in range(num_locals)]
+    names = [x[1] for x in params + local_vars] or ["0"]
+
+    c_lines = ["int " + funcname + "(" + (", ".join(t + " " + n for t, n in params) or "void") + ") {"]
+    rust_lines = ["#[no_mangle]",
+                  "pub extern \"C\" fn " + funcname + "(" + ", ".join(n + ": " + rust_types[t] for t, n in params) + ") -> i32 {"]
+    for t, n in local_vars:
+        c_lines.append("    " + t + " " + n + " = 0;")
+        rust_lines.append("    let mut " + n + ": " + rust_types[t] + " = 0 as " + rust_types[t] + ";")
+    for i in range(num_stmts):
+        a, b = rnd.choice(names), rnd.choice(names)
+        kind = rnd.random()
+        if kind < 0.2:
+            c_lines.append("    if (" + a + " > " + b + ") { " + a + " = " + b + "; }")
+            rust_lines.append("    if " + a + " as i64 > " + b + " as i64 { }")
+        elif kind < 0.3:
+            c_lines.append("    for (int i" + str(i) + " = 0; i" + str(i) + " < 10; i" + str(i) + "++) { }")
+            rust_lines.append("    for i" + str(i) + " in 0..10 { }")
+        else:
+            c_lines.append("    " + a + " = " + a + " + " + str(i) + ";")
+            rust_lines.append("    let _s" + str(i) + " = " + str(i) + ";")
+    for i in range(num_unsafe):
+        rust_lines.append("    unsafe {")
+        rust_lines += ["        let _u" + str(i) + "_" + str(j) + " = " + str(j) + ";" for j in range(rnd.randint(1, 5))]
+        rust_lines.append("    }")
+    c_lines += ["    return 0;", "}"]
+    rust_lines += ["    0", "}"]
+
+    return "\n".join(c_lines) + "\n", "\n".join(rust_lines) + "\n"
+
+def generate_project(rnd, out_dir, proj_name, num_functions, num_files, dup_ratio, model, sources, no_rust=False):
+    # sources is shared between the projects, so that duplicates also occur across projects
+    c_dir = os.path.join(out_dir, proj_name, "preprocessed_sf")
+    rust_dir = os.path.join(out_dir, proj_name, "rust_" + model + "_sf_withfixing")
+    os.makedirs(c_dir, exist_ok=True)
+    os.makedirs(rust_dir, exist_ok=True)
+
+    with open(os.path.join(rust_dir, "transpilation.log"), "w") as log_file:
+        for i in range(num_functions):
+            if sources and rnd.random() < dup_ratio:
+                # A copy of a function, with different whitespace, in another file
+                c_code, rust_code, funcname = rnd.choice(sources)
+                c_code = c_code.replace("\n    ", "\n  ")
+                rust_code = rust_code.replace("\n    ", "\n\t")
+                filename = "copy" + str(i)
+            else:
+                filename = "file" + str(i % num_files)
+                funcname = proj_name + "_func" + str(i)
+                c_code, rust_code = generate_function(rnd, funcname)
+                sources.append((c_code, rust_code, funcname))
+
+            basename = proj_name + "#" + filename + "#" + funcname
+            with open(os.path.join(c_dir, basename + ".c"), "w") as f:
+                f.write(c_code)
+            if no_rust:
+                continue
+            with open(os.path.join(rust_dir, basename + ".rs"), "w") as f:
+                f.write(rust_code)
+
+            # file;transpilation_res;compilation_res;transpilation_time;num_comp_iter;comp_fix_time;post_iter;post_time
+            num_comp_iter = min(20, int(rnd.expovariate(1 / (1 + c_code.count("\n") / 40))))
+            log_file.write(basename + ".c;True;True;" + str(rnd.randint(1, 30)) + ";" + str(num_comp_iter) + ";" +
+                           str(num_comp_iter * rnd.randint(2, 20)) + ";1;" + str(rnd.randint(1, 10)) + "\n")
+
+def main():
+
+    opts, args = parse_args()
+    log.init_log(logging.INFO)
+
+    rnd = random.Random(opts.seed)
+    sources = []
+    for i in range(opts.projects):
+        proj_name = "proj" + str(i)
+        generate_project(rnd, opts.out, proj_name, opts.functions, opts.files, opts.dup_ratio, opts.model, sources, opts.no_rust)
+        logger.info("Generated " + proj_name + " with " + str(opts.functions) + " functions")
+
+if __name__ == "__main__":
+    main()
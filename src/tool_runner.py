@@ -0,0 +1,128 @@
+import os
+import time
+import signal
+import subprocess
+
+import logging
+import profiler
+
+logger = logging.getLogger(__name__)
+
+# Time budget in seconds of a single invocation of every external tool. Each
+# budget can be overridden with an environment variable, e.g. TOOL_TIMEOUT_RUSTC=60
+TOOL_TIMEOUTS = {
+    "docker": 60,
+    "ccccc": 300,
+    "rust-code-analysis": 60,
+    "rust-code-analysis-batch": 3600,
+    "dump-unsafe-usage": 60,
+    "dump-var-types": 60,
+    "add-pub-no-mangle": 60,
+    "cargo": 300,
+    "rustc": 300,
+    "ollama": 600,
+}
+
+# Retries after a timeout. Only the tools whose stalls can be transient are
+# retried, rerunning a deterministic analysis on the same input stalls again.
+TOOL_RETRIES = {
+    "docker": 1,
+    "cargo": 1,
+    "ollama": 1,
+}
+
+class ToolTimeout(Exception):
+    def __init__(self, tool, item, timeout):
+        super().__init__(tool + " timed out after " + str(timeout) + "s on " + str(item))
+        self.tool = tool
+        self.item = item
+        self.timeout = timeout
+
+# Wall time of every invocation and the items that ran out of time, per tool
+latencies = {}
+timed_out = {}
+
+def get_timeout(tool):
+    env_name = "TOOL_TIMEOUT_" + tool.upper().replace("-", "_")
+    return float(os.environ.get(env_name, TOOL_TIMEOUTS.get(tool, 600)))
+
+def record(tool, start_time, item, timed_out=False):
+    elapsed = time.perf_counter() - start_time
+    latencies.setdefault(tool, []).append(elapsed)
+    profiler.add_span("tool", tool, start_time, elapsed, item=str(item), timed_out=timed_out)
+    if timed_out:
+        profiler.count(tool + " timeouts")
+
+def kill_process_group(p):
+    # The tools run in their own session, so the group also holds their children
+    # (e.g. rustc under cargo)
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    p.communicate()
+
+def run_tool(tool, cmd, item=None, timeout=None, retries=None, cwd=None):
+    # Runs cmd and returns (returncode, stdout, stderr) as bytes. The whole process
+    # group is killed once the budget of the tool is exhausted and the invocation
+    # is retried up to TOOL_RETRIES times before ToolTimeout is raised.
+    if timeout is None:
+        timeout = get_timeout(tool)
+    if retries is None:
+        retries = TOOL_RETRIES.get(tool, 0)
+    if item is None:
+        item = " ".join(cmd)
+
+    for attempt in range(retries + 1):
+        start_time = time.perf_counter()
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                             cwd=cwd, start_new_session=True)
+        try:
+            out, err = p.communicate(timeout=timeout)
+            record(tool, start_time, item)
+            return p.returncode, out, err
+        except subprocess.TimeoutExpired:
+            kill_process_group(p)
+            record(tool, start_time, item, timed_out=True)
+            logger.warning(tool + " timed out after " + str(timeout) + "s on " + str(item) +
+                           " (attempt " + str(attempt + 1) + " of " + str(retries + 1) + ")")
+
+    timed_out.setdefault(tool, []).append(item)
+    raise ToolTimeout(tool, item, timeout)
+
+def call_tool(tool, func, *args, item=None, timeout_errors=(), retries=None, **kwargs):
+    # Same bookkeeping as run_tool for tools that are called through a client
+    # library with its own timeout (e.g. ollama), timeout_errors are the
+    # exceptions that the library raises when the budget is exhausted
+    if retries is None:
+        retries = TOOL_RETRIES.get(tool, 0)
+
+    for attempt in range(retries + 1):
+        start_time = time.perf_counter()
+        try:
+            res = func(*args, **kwargs)
+            record(tool, start_time, item)
+            return res
+        except timeout_errors:
+            record(tool, start_time, item, timed_out=True)
+            logger.warning(tool + " timed out on " + str(item) +
+                           " (attempt " + str(attempt + 1) + " of " + str(retries + 1) + ")")
+
+    timed_out.setdefault(tool, []).append(item)
+    raise ToolTimeout(tool, item, get_timeout(tool))
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile
+    index = max(0, int(-(-q * len(sorted_values) // 100)) - 1)
+    return sorted_values[index]
+
+def report():
+    for tool, values in sorted(latencies.items()):
+        values = sorted(values)
+        logger.info(tool + ": " + str(len(values)) + " calls, p50 " + str(round(percentile(values, 50), 2)) +
+                    "s, p95 " + str(round(percentile(values, 95), 2)) + "s, p99 " +
+                    str(round(percentile(values, 99), 2)) + "s, max " + str(round(values[-1], 2)) +
+                    "s, budget " + str(get_timeout(tool)) + "s, timed out " + str(len(timed_out.get(tool, []))))
+    for tool, items in sorted(timed_out.items()):
+        for item in items:
+            logger.warning(tool + " timed out on " + str(item))